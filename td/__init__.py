@@ -0,0 +1,19 @@
+"""TD: trial design. Schedule-of-Assessments figures for clinical studies
+
+Python API:
+
+	import td
+	svg = td.render(td.read_design("study.json"), condensed=True)
+
+render() takes a parsed trial design and returns the svg document as string, as bytes or writes it to a file object, without changing the design.
+"""
+
+__all__ = ["__version__", "design_dict", "parse_design", "read_design", "render", "render_td"]
+
+
+def __getattr__(name):
+	# imported on first use, so that `python -m td.td` does not import td.td twice
+	if name in __all__:
+		from . import td
+		return(getattr(td, name))
+	raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
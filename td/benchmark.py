@@ -0,0 +1,151 @@
+# TD: trial design. A command line tool to make Schedule-of-Assessments figures for clinical studies
+# Copyright (C) 2022 Rainer Strotmann (rainer.strotmann@mailbox.org)
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Benchmark render_td over the test fixtures and synthetic designs
+
+Run with `python -m td.benchmark`. Results can be saved as json and compared against a saved baseline.
+"""
+
+from typing import List
+import copy
+import json
+import pathlib
+import sys
+import time
+import typer
+
+from .generate import generate_design
+from .td import __version__, expand_inputs, read_design, render_td
+
+FIXTURES = pathlib.Path(__file__).parent.joinpath("tests", "fixtures")
+
+# option combinations, named after the corresponding command line options
+COMBINATIONS = {
+	"plain": {},
+	"-A": dict(condensed=True, timescale=True, graph=True, ellipsis=True, footnotes=True),
+	"-a": dict(autocompress=True),
+	"-c": dict(condensed=True),
+	"-t": dict(timescale=True)}
+
+PHASES = ["parse", "validation", "metrics", "layout", "rendering", "output"]
+
+
+SYNTHETIC = {
+	"synthetic-long": dict(periods=1, duration=2000, procedures=200, times=12, footnotes=20, daylabels=7, dayshading=7),
+	"synthetic-cycles": dict(periods=1, cycles=40, cycle_duration=28, procedures=100, times=8, footnotes=5, depth=2)}
+
+
+def time_render(td, options, repeat=3):
+	"""return the fastest of repeated renders as dictionary of phase times and total time, with the row phases summed up as rendering"""
+	best = None
+	for i in range(repeat):
+		profile = {}
+		start = time.perf_counter()
+		render_td(copy.deepcopy(td), **options, profile=profile)
+		result = {"total": time.perf_counter() - start}
+		for name, entry in profile.items():
+			phase = name if name in PHASES else "rendering"
+			result[phase] = result.get(phase, 0) + entry["time"]
+		if best is None or result["total"] < best["total"]:
+			best = result
+	return(best)
+
+
+def run_benchmark(files, combinations=COMBINATIONS, synthetic=SYNTHETIC, repeat=3):
+	"""time render_td for all files and synthetic designs and all option combinations
+
+	:rtype:		dict
+	:return:	phase times in seconds by "design|combination", or the error message for failed renders
+	"""
+	designs = {}
+	for f in files:
+		start = time.perf_counter()
+		td = read_design(f)
+		designs[f.name] = (td, time.perf_counter() - start)
+	for name, kwargs in synthetic.items():
+		designs[name] = (generate_design(**kwargs), 0)
+
+	results = {}
+	for name, (td, parse_time) in designs.items():
+		for combination, options in combinations.items():
+			try:
+				result = time_render(td, options, repeat)
+			except Exception as err:
+				result = {"error": str(err)}
+			else:
+				result["parse"] = parse_time
+				result["total"] += parse_time
+			results[f'{name}|{combination}'] = result
+	return(results)
+
+
+def compare(results, baseline, threshold=0.2):
+	"""return (key, baseline time, time) for all renders that are slower than the baseline by more than the threshold fraction"""
+	out = []
+	for key, result in results.items():
+		base = baseline.get(key, {})
+		if "total" in result and "total" in base:
+			if result["total"] > base["total"] * (1 + threshold):
+				out.append((key, base["total"], result["total"]))
+	return(out)
+
+
+def format_results(results):
+	"""format results as text table with times in milliseconds"""
+	width = max([len(k) for k in results] + [6])
+	lines = [f'{"design":<{width}}' + "".join([f'{p:>11}' for p in PHASES + ["total"]])]
+	for key, result in results.items():
+		if "error" in result:
+			lines.append(f'{key:<{width}}  error: {result["error"]}')
+		else:
+			lines.append(f'{key:<{width}}' + "".join([f'{result.get(p, 0) * 1000:>11.1f}' for p in PHASES + ["total"]]))
+	return("\n".join(lines))
+
+
+app = typer.Typer(add_completion=False)
+
+
+@app.command()
+def main(
+	files: List[str] = typer.Argument(None, help="Design files, glob patterns or directories, default: test fixtures"),
+	repeat: int = typer.Option(3, "--repeat", "-r", help="Renders per design and option combination, the fastest is reported"),
+	save: str = typer.Option("", "--save", help="Save results to json file"),
+	baseline: str = typer.Option("", "--baseline", "-b", help="Compare against results saved in json file"),
+	threshold: float = typer.Option(0.2, "--threshold", help="Slowdown fraction that counts as regression"),
+	no_synthetic: bool = typer.Option(False, "--no-synthetic", help="Skip synthetic large designs"),
+	):
+	"""Benchmark td rendering per design and option combination"""
+	infiles = expand_inputs(files or [str(FIXTURES)])
+	results = run_benchmark(infiles, synthetic={} if no_synthetic else SYNTHETIC, repeat=repeat)
+	typer.echo(format_results(results))
+
+	if save:
+		with open(save, "w") as f:
+			json.dump({"version": __version__, "results": results}, f, indent=2)
+
+	if baseline:
+		with open(baseline) as f:
+			regressions = compare(results, json.load(f)["results"], threshold)
+		if regressions:
+			typer.echo(f'\n{len(regressions)} regression(s) above {threshold:.0%}:', err=True)
+			for (key, base, new) in regressions:
+				typer.echo(f'  {key}: {base * 1000:.1f} ms -> {new * 1000:.1f} ms', err=True)
+			sys.exit(1)
+		typer.echo(f'\nno regressions above {threshold:.0%}')
+
+
+if __name__ == "__main__":
+	app()
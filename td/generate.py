@@ -0,0 +1,152 @@
+# TD: trial design. A command line tool to make Schedule-of-Assessments figures for clinical studies
+# Copyright (C) 2022 Rainer Strotmann (rainer.strotmann@mailbox.org)
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Generate synthetic trial designs of configurable size for load and scaling tests
+
+Run with `td-generate` or `python -m td.generate`. The same parameters and seed always give the same design.
+"""
+
+import json
+import random
+import sys
+import typer
+
+
+def make_days(rng, duration, count):
+	"""return a days field with about count days between 1 and duration, using day ranges for runs of days"""
+	days = sorted(rng.sample(range(1, duration + 1), min(count, duration)))
+	out = []
+	run_start = last = days[0]
+	for d in days[1:] + [None]:
+		if d is not None and d == last + 1:
+			last = d
+			continue
+		out.append(run_start if run_start == last else f'{run_start}-{last}')
+		if d is not None:
+			run_start = last = d
+	return(out)
+
+
+def make_period(rng, caption, duration, procedures=10, administrations=1, times=0, footnotes=0, daylabels=1, dayshading=0, start=1):
+	"""return a period with random procedures
+
+	:param times:		number of sampling times per PK procedure, no PK procedure if 0
+	:param footnotes:	number of footnotes on the procedures of the period
+	:param daylabels:	label every n-th day
+	:param dayshading:	shade every n-th day, no shading if 0
+	"""
+	period = {
+		"caption": caption,
+		"start": start,
+		"duration": duration,
+		"daylabels": list(range(1, duration + 1, daylabels))}
+	if dayshading:
+		period["dayshading"] = list(range(dayshading, duration + 1, dayshading))
+
+	density = rng.uniform(0.1, 0.5)
+	period["procedures"] = [
+		{"caption": f'Procedure {i+1}', "days": make_days(rng, duration, max(1, int(duration * density)))}
+		for i in range(procedures)]
+	if times and duration > 2:
+		period["procedures"].append({
+			"caption": "PK sampling",
+			"days": [1],
+			"times": sorted(rng.sample([i / 4 for i in range(1, 96)], min(times - 1, 95)) + [0]),
+			"relative": 1,
+			"timescale": "show"})
+	period["administrations"] = [
+		{"caption": f'Drug {chr(65 + i % 26)}', "days": make_days(rng, duration, max(1, duration // 2)), "dose": rng.choice([50, 100, 200])}
+		for i in range(administrations)]
+
+	for i in range(footnotes):
+		if not period["procedures"]:
+			break
+		proc = rng.choice(period["procedures"])
+		proc.setdefault("footnotes", []).append({
+			"days": rng.choice(proc["days"]),
+			"symbol": chr(97 + i % 26) + (str(i // 26) if i >= 26 else ""),
+			"text": f'Footnote text {i+1}'})
+	return(period)
+
+
+def nest_periods(periods, depth, caption="Group"):
+	"""wrap a list of periods in depth levels of nested period groups, each level splitting its periods in two halves"""
+	if depth <= 0 or len(periods) < 2:
+		return(periods)
+	half = len(periods) // 2
+	return([
+		{"caption": f'{caption} 1', "periods": nest_periods(periods[:half], depth - 1, f'{caption} 1.')},
+		{"caption": f'{caption} 2', "periods": nest_periods(periods[half:], depth - 1, f'{caption} 2.')}])
+
+
+def generate_design(periods=2, cycles=0, duration=14, cycle_duration=21, depth=0, procedures=10, administrations=1, times=0, footnotes=0, daylabels=1, dayshading=0, seed=0):
+	"""return a valid trial design of the requested size
+
+	:param periods:			number of periods
+	:param cycles:			number of treatment cycles, appended after the periods
+	:param duration:		days per period
+	:param cycle_duration:	days per cycle
+	:param depth:			nesting depth of period groups
+	:param procedures:		procedures per period or cycle
+	:param administrations:	administrations per period or cycle
+	:param times:			sampling times per PK procedure, no PK procedures if 0
+	:param footnotes:		footnotes per period or cycle
+	:param daylabels:		label every n-th day
+	:param dayshading:		shade every n-th day, no shading if 0
+	:param seed:			random seed
+	:rtype:					dict
+	"""
+	rng = random.Random(seed)
+	kwargs = dict(procedures=procedures, administrations=administrations, times=times, footnotes=footnotes, daylabels=daylabels, dayshading=dayshading)
+	out = [make_period(rng, f'Period {i+1}', duration, **kwargs) for i in range(periods)]
+	out += [make_period(rng, f'Cycle {i+1}', cycle_duration, **kwargs) for i in range(cycles)]
+	return({"periods": nest_periods(out, depth)})
+
+
+app = typer.Typer(add_completion=False)
+
+
+@app.command()
+def main(
+	output: str = typer.Argument("", help="Output file (.json, .yaml or .yml), default: json to standard output"),
+	periods: int = typer.Option(2, "--periods", "-p", help="Number of periods"),
+	cycles: int = typer.Option(0, "--cycles", "-c", help="Number of treatment cycles after the periods"),
+	duration: int = typer.Option(14, "--duration", "-d", help="Days per period"),
+	cycle_duration: int = typer.Option(21, "--cycle-duration", help="Days per cycle"),
+	depth: int = typer.Option(0, "--depth", help="Nesting depth of period groups"),
+	procedures: int = typer.Option(10, "--procedures", "-n", help="Procedures per period"),
+	administrations: int = typer.Option(1, "--administrations", "-a", help="Administrations per period"),
+	times: int = typer.Option(0, "--times", "-t", help="Sampling times per PK procedure, 0 for no PK procedures"),
+	footnotes: int = typer.Option(0, "--footnotes", "-f", help="Footnotes per period"),
+	daylabels: int = typer.Option(1, "--daylabels", help="Label every n-th day"),
+	dayshading: int = typer.Option(0, "--dayshading", help="Shade every n-th day, 0 for no shading"),
+	seed: int = typer.Option(0, "--seed", help="Random seed"),
+	):
+	"""Generate a synthetic trial design for load and scaling tests"""
+	td = generate_design(periods=periods, cycles=cycles, duration=duration, cycle_duration=cycle_duration, depth=depth, procedures=procedures, administrations=administrations, times=times, footnotes=footnotes, daylabels=daylabels, dayshading=dayshading, seed=seed)
+	if not output:
+		json.dump(td, sys.stdout, indent=2)
+		return
+	with open(output, "w") as f:
+		if output.lower().endswith((".yaml", ".yml")):
+			import yaml
+			yaml.dump(td, f, default_flow_style=None)
+		else:
+			json.dump(td, f, indent=2)
+
+
+if __name__ == "__main__":
+	app()
@@ -0,0 +1,200 @@
+# TD: trial design. A command line tool to make Schedule-of-Assessments figures for clinical studies
+# Copyright (C) 2022 Rainer Strotmann (rainer.strotmann@mailbox.org)
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Render server that keeps td warm and renders designs posted over local HTTP or a Unix socket
+
+Run with `td-serve` or `python -m td.server`. POST a json or yaml design to /render, with the rendering options as query parameters (e.g., /render?condensed=1&timescale=1), and the svg figure is returned. GET /health returns "ok".
+"""
+
+from urllib.parse import parse_qsl, urlsplit
+import asyncio
+import concurrent.futures
+import functools
+import sys
+import typer
+
+from .td import __version__, cache_key, cache_lookup, cache_store, init_worker, parse_design, render_td
+
+BOOLEAN_OPTIONS = ("condensed", "autocompress", "timescale", "ellipsis", "footnotes", "graph", "compact")
+OPTION_TYPES = {"title": str, "font": str, "fontsize": int, "padding": float}
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 413: "Payload Too Large", 422: "Unprocessable Entity"}
+
+
+def request_options(query):
+	"""convert the query string of a render request to render_td keyword arguments
+
+	Boolean options are true if given without value or as 1, true or yes. all=1 is equivalent to the -A command line option.
+	"""
+	out = {}
+	for key, value in parse_qsl(query, keep_blank_values=True):
+		if key == "all" or key in BOOLEAN_OPTIONS:
+			flag = value.lower() in ("", "1", "true", "yes")
+			for k in (("condensed", "timescale", "graph", "ellipsis", "footnotes") if key == "all" else (key,)):
+				out[k] = flag
+		elif key in OPTION_TYPES:
+			try:
+				out[key] = OPTION_TYPES[key](value)
+			except ValueError:
+				raise ValueError(f'invalid value "{value}" for option {key}')
+		else:
+			raise ValueError(f'unknown option "{key}"')
+	return(out)
+
+
+def render_design(td, cache="", cache_size=100 * 2**20, **kwargs):
+	"""render design to svg, through the render cache if cache names a cache directory. Keyword arguments are passed on to render_td"""
+	if cache:
+		key = cache_key(td, **kwargs)
+		cached = cache_lookup(cache, key)
+		if cached:
+			return(cached.read_text())
+	svg_out = render_td(td, **kwargs)
+	if cache:
+		cache_store(cache, key, svg_out, cache_size)
+	return(svg_out)
+
+
+async def handle_request(method, target, body, render):
+	"""return (status, content type, content) for a request
+
+	:param render:	coroutine function that renders (td, options) to svg
+	"""
+	url = urlsplit(target)
+	if url.path == "/health":
+		return((200, "text/plain", "ok"))
+	if url.path != "/render":
+		return((404, "text/plain", f'no such resource: {url.path}'))
+	if method != "POST":
+		return((405, "text/plain", "use POST to render designs"))
+	try:
+		options = request_options(url.query)
+		td = parse_design(body.decode("utf-8"))
+	except Exception as err:
+		return((400, "text/plain", f'{err}'))
+	try:
+		svg_out = await render(td, options)
+	except Exception as err:
+		return((422, "text/plain", f'{err}'))
+	return((200, "image/svg+xml", svg_out))
+
+
+async def respond(writer, status, content_type, content, keep_alive=False):
+	"""write http response"""
+	payload = content.encode("utf-8")
+	head = [
+		f'HTTP/1.1 {status} {REASONS.get(status, "")}',
+		f'Content-Type: {content_type}; charset=utf-8',
+		f'Content-Length: {len(payload)}',
+		f'Connection: {"keep-alive" if keep_alive else "close"}',
+		f'Server: td/{__version__}']
+	writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + payload)
+	await writer.drain()
+
+
+async def handle_connection(reader, writer, render, max_size=10 * 2**20):
+	"""serve the http requests of a connection, keeping HTTP/1.1 connections open for further requests"""
+	try:
+		while True:
+			line = await reader.readline()
+			if not line:
+				break
+			try:
+				(method, target, protocol) = line.decode("latin-1").split()
+			except ValueError:
+				await respond(writer, 400, "text/plain", "malformed request line")
+				break
+			headers = {}
+			while True:
+				line = await reader.readline()
+				if line in (b"\r\n", b"\n", b""):
+					break
+				(name, _, value) = line.decode("latin-1").partition(":")
+				headers[name.strip().lower()] = value.strip()
+			try:
+				length = int(headers.get("content-length", 0))
+			except ValueError:
+				await respond(writer, 400, "text/plain", "invalid Content-Length")
+				break
+			if length > max_size:
+				await respond(writer, 413, "text/plain", f'designs are limited to {max_size} bytes')
+				break
+			if headers.get("expect", "").lower() == "100-continue":
+				writer.write(b"HTTP/1.1 100 Continue\r\n\r\n")
+				await writer.drain()
+			body = await reader.readexactly(length) if length else b""
+			keep_alive = protocol == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+			(status, content_type, content) = await handle_request(method, target, body, render)
+			await respond(writer, status, content_type, content, keep_alive)
+			if not keep_alive:
+				break
+	except (ConnectionError, asyncio.IncompleteReadError):
+		pass
+	finally:
+		writer.close()
+
+
+async def serve(host="127.0.0.1", port=8080, socket="", jobs=0, max_size=10 * 2**20, **kwargs):
+	"""serve render requests until cancelled, rendering in a pool of worker processes
+
+	jobs=0 uses one process per CPU. Keyword arguments are defaults for render_design, render request options take precedence.
+	"""
+	loop = asyncio.get_running_loop()
+	initargs = (kwargs.get("font", "Arial"), kwargs.get("fontsize", 14), kwargs.get("text_metrics", "cairo"), kwargs.get("glyph_table", ""))
+	with concurrent.futures.ProcessPoolExecutor(max_workers=jobs or None, initializer=init_worker, initargs=initargs) as pool:
+		async def render(td, options):
+			return(await loop.run_in_executor(pool, functools.partial(render_design, td, **{**kwargs, **options})))
+
+		handler = functools.partial(handle_connection, render=render, max_size=max_size)
+		if socket:
+			server = await asyncio.start_unix_server(handler, path=socket)
+			typer.echo(f'td server listening on {socket}', err=True)
+		else:
+			server = await asyncio.start_server(handler, host, port)
+			typer.echo(f'td server listening on http://{host}:{port}', err=True)
+		async with server:
+			await server.serve_forever()
+
+
+app = typer.Typer(add_completion=False)
+
+
+@app.command()
+def main(
+	host: str = typer.Option("127.0.0.1", "--host", help="Address to listen on"),
+	port: int = typer.Option(8080, "--port", help="Port to listen on"),
+	socket: str = typer.Option("", "--socket", help="Listen on this Unix socket instead of host and port"),
+	jobs: int = typer.Option(0, "--jobs", "-j", min=0, help="Number of rendering processes, 0 for one per CPU"),
+	font: str = typer.Option("Arial", "--font", "-f", help="Default font type"),
+	fontsize: int = typer.Option(14, "--fontsize", "-s", help="Default font size"),
+	metrics: str = typer.Option("cairo", "--metrics", "-m", help="Text metrics engine (cairo or glyphs)"),
+	glyph_table: str = typer.Option("", "--glyph-table", help="Glyph metrics file for the glyphs engine, implies '-m glyphs'"),
+	cache: str = typer.Option("", "--cache", help="Render cache directory"),
+	cache_size: int = typer.Option(100, "--cache-size", help="Maximum render cache size in MB"),
+	max_size: int = typer.Option(10, "--max-size", help="Maximum design size in MB"),
+	):
+	"""Serve td renders over local HTTP or a Unix socket"""
+	if glyph_table:
+		metrics = "glyphs"
+	try:
+		asyncio.run(serve(host=host, port=port, socket=socket, jobs=jobs, max_size=max_size * 2**20, font=font, fontsize=fontsize, text_metrics=metrics, glyph_table=glyph_table, cache=cache, cache_size=cache_size * 2**20))
+	except KeyboardInterrupt:
+		pass
+	except OSError as err:
+		sys.exit(f'{err}')
+
+
+if __name__ == "__main__":
+	app()
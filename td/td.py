@@ -16,14 +16,20 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-from asyncio import start_server
 import typer
-import pathlib2 as pathlib
-import cairo
+import functools
+import glob
+import hashlib
 import json
+import os
+import pathlib
 import re
 import sys
-import yaml
+import threading
+import time
+from typing import List
+
+# cairo, yaml, shutil, tempfile and concurrent.futures are imported where they are used, to keep the start-up fast
 
 # GLOBAL VARIABLES
 __version__ = "2.1"
@@ -64,27 +70,37 @@ def assert_interval_format(interval):
 	return
 
 
+# DAY MASKS
+# sets of day indices as int bit masks, bit i for index i, so that runs and edges are found with a few integer operations
+
+def list_mask(x):
+	"""return bit mask of the True values in list of booleans"""
+	return(int("".join("1" if i else "0" for i in reversed(x)) or "0", 2))
+
+
+def mask_list(mask, length):
+	"""return list of booleans of length from bit mask"""
+	return([c == "1" for c in reversed(f'{mask:0{length}b}'[-length:])] if length > 0 else [])
+
+
+def leading_mask(mask):
+	"""return the first bits of the runs of set bits in mask"""
+	return(mask & ~(mask << 1))
+
+
+def trailing_mask(mask):
+	"""return the last bits of the runs of set bits in mask"""
+	return(mask & ~(mask >> 1))
+
+
 def leading_edge(x):
 	"""return leading True values in list of booleans"""
-	out = []
-	status = False
-	for i in x:
-		out.append(i and i != status)
-		if i != status:
-			status = i
-	return(out)
+	return(mask_list(leading_mask(list_mask(x)), len(x)))
 
 
 def trailing_edge(x):
 	"""return trailing True values in list of booleans"""
-	out = []
-	status = x[0]
-	for i in x:
-		out.append(not i and i != status)
-		if i != status:
-			status = i
-	out.append(x[-1])
-	return(out[1:])
+	return(mask_list(trailing_mask(list_mask(x)), len(x)))
 
 
 def decode_daylist(daylist: list) -> list:
@@ -97,24 +113,36 @@ def decode_daylist(daylist: list) -> list:
 	:rtype:			list
 	:return:		list of days in strict numerical form
 	"""
-	days = []
+	return(list(daylist_tuple(daylist)))
+
+
+DAYLIST_ELEMENT = re.compile(r'(\d+)(?:-(\d+))?')
+
+
+def daylist_tuple(daylist):
+	"""return the decoded 'days' field as tuple, see decode_daylist
+
+	The result is shared between calls with the same input and must not be changed.
+	"""
 	if not isinstance(daylist, list):
 		daylist = [daylist]
-	for i in daylist:
+	return(decode_daytuple(tuple([i for i in daylist if isinstance(i, (int, str))])))
+
+
+@functools.lru_cache(maxsize=4096)
+def decode_daytuple(daytuple):
+	"""decode tuple of numbers and day range strings to tuple of days"""
+	days = []
+	for i in daytuple:
 		if isinstance(i, int):
 			days.append(i)
-		elif isinstance(i, str):
-			pat_element = r'(\d+)(-(\d+))?'
-			pat = f'({pat_element}(, )*)'
-			m = re.findall(pat, i)
-			if m:
-				for mm in m:
-					if mm[3] == "":
-						days.append(int(mm[1]))
-					else:
-						for i in range(int(mm[1]), int(mm[3])+1):
-							days.append(i)
-	return(days)
+		else:
+			for m in DAYLIST_ELEMENT.finditer(i):
+				if m[2] is None:
+					days.append(int(m[1]))
+				else:
+					days.extend(range(int(m[1]), int(m[2])+1))
+	return(tuple(days))
 
 
 def item_names(periods, item_class):
@@ -140,7 +168,32 @@ def item_names(periods, item_class):
 	return(out)
 
 
-def iterate_over_procedures(period, caption, out, function):
+def index_items(periods):
+	"""index the intervals, administrations and procedures of all periods by caption in one pass
+
+	Items are indexed by (id(period), caption) over all item classes, and by (id(period), caption, item_class) for the individual item classes. The footnotes of the items are collected in the same pass, by ("footnotes", id(period), caption) in the format of extract_footnotes. The index is only valid while the periods exist.
+
+	:param periods:	periods to index
+	:type periods:	list of period dictionaries
+	:rtype:			dict
+	:return:		lists of items in the order of intervals, administrations, procedures
+	"""
+	index = {}
+	for p in periods:
+		for x in ['intervals', 'administrations', 'procedures']:
+			if x in p.keys():
+				for proc in p[x]:
+					index.setdefault((id(p), proc['caption']), []).append(proc)
+					index.setdefault((id(p), proc['caption'], x), []).append(proc)
+					if 'footnotes' in proc.keys():
+						key = ("footnotes", id(p), proc['caption'])
+						if key not in index:
+							index[key] = [[False] * p['duration'], [''] * p['duration'], []]
+						add_footnotes(p, proc, index[key])
+	return(index)
+
+
+def iterate_over_procedures(period, caption, out, function, index=None):
 	"""apply a reduce function to all procedures with a given caption
 	
 	:param period:	period
@@ -149,9 +202,15 @@ def iterate_over_procedures(period, caption, out, function):
 	:type caption:	string
 	:param out:		accumulator start value, mostly a list with length of the period
 	:type out:		flexible
+	:param index:	item index as returned by index_items, if None the period is searched
+	:type index:	dict
 	:rtype:			flexible
 	:return:		 accumulator out
 	"""
+	if index is not None:
+		for proc in index.get((id(period), caption), []):
+			function(proc, out)
+		return(out)
 	for x in ['intervals', 'administrations', 'procedures']:
 		if x in period.keys():
 			for proc in period[x]:
@@ -160,7 +219,7 @@ def iterate_over_procedures(period, caption, out, function):
 	return(out)
 
 
-def extract_procedure(period, caption):
+def extract_procedure(period, caption, index=None):
 	"""get specified administration/procedure as list of tuples (day, [times], relative) for individual days
 	"""
 	out = []
@@ -176,99 +235,116 @@ def extract_procedure(period, caption):
 			rel = proc['relative']
 		else:
 			rel = 1
-		out += [(d, t, rel) for d in decode_daylist(proc['days'])]
+		out += [(d, t, rel) for d in daylist_tuple(proc['days'])]
 		return(out)
 
-	return(iterate_over_procedures(period, caption, out, temp))
+	return(iterate_over_procedures(period, caption, out, temp, index))
 
 
-def extract_labels(period, caption):
+def extract_labels(period, caption, index=None):
 	out = [""] * period['duration']
 
 	def temp(proc, out):
 		if 'labels' in proc.keys():
 			if 'days' in proc.keys():
-				for d, l in zip(decode_daylist(proc['days']), proc['labels']):
+				for d, l in zip(daylist_tuple(proc['days']), proc['labels']):
 					out[day_index(period, d)] = l
 			elif 'start' in proc.keys() and 'duration' in proc.keys():
 				out[day_index(period, proc["start"])] = proc['labels'][0]
 		return(out)
 
-	return(iterate_over_procedures(period, caption, out, temp))
+	return(iterate_over_procedures(period, caption, out, temp, index))
 
 
-def extract_footnotes(period, caption):
-	"""extract footnotes for procedures by day, if applicable"""
-	out = [[False] * period['duration'], [''] * period['duration'], []]
-
-	def temp(proc, out):
-		if 'footnotes' in proc.keys():
-			for f in proc["footnotes"]:
-				if "days" not in f.keys():
-					raise KeyError(f'no "days" in footnote "{f["text"]}"')
+def add_footnotes(period, proc, out):
+	"""add the footnotes of a procedure to out, see extract_footnotes"""
+	if 'footnotes' in proc.keys():
+		for f in proc["footnotes"]:
+			if "days" not in f.keys():
+				raise KeyError(f'no "days" in footnote "{f["text"]}"')
+			else:
+				if not isinstance(f["days"], list):
+					daylist = [f["days"]]
 				else:
-					if not isinstance(f["days"], list):
-						daylist = [f["days"]]
-					else:
-						daylist = f["days"]
-					for d in decode_daylist(daylist):
-						i = day_index(period, d)
-						out[0][i] = True
-						if out[1][i]:
-							out[1][i] += ","
-						out[1][i] += str(f['symbol'])
-						out[2].append([f['symbol'], f['text']])
-		return(out)
+					daylist = f["days"]
+				for d in daylist_tuple(daylist):
+					i = day_index(period, d)
+					out[0][i] = True
+					if out[1][i]:
+						out[1][i] += ","
+					out[1][i] += str(f['symbol'])
+					out[2].append([f['symbol'], f['text']])
+	return(out)
 
-	return(iterate_over_procedures(period, caption, out, temp))
 
+def extract_footnotes(period, caption, index=None):
+	"""extract footnotes for procedures by day, if applicable
 
-def footnote_list(periods):
+	Returns [flags by day, symbols by day, list of [symbol, text]]. With index, the footnotes are taken from the index and must not be changed.
+	"""
+	if index is not None:
+		cell = index.get(("footnotes", id(period), caption))
+		if cell is not None:
+			return(cell)
+		return([[False] * period['duration'], [''] * period['duration'], []])
+	out = [[False] * period['duration'], [''] * period['duration'], []]
+	return(iterate_over_procedures(period, caption, out, lambda proc, out: add_footnotes(period, proc, out)))
+
+
+def footnote_list(periods, index=None):
+	"""return the sorted list of [symbol, text] of all footnotes, the first text with a symbol counts"""
 	cpt = []
 	for n in ['intervals', 'administrations', 'procedures']:
 		cpt += item_names(periods, n)
-	fn = []
+	fn = {}
 	for c in cpt:
 		for p in periods:
-			f = extract_footnotes(p, c)[2]
-			for ff in f:
-				if not ff[0] in [i[0] for i in fn] and ff[1] != "":
-					fn.append(ff)
-	return(sorted(fn))
+			for (symbol, text) in extract_footnotes(p, c, index)[2]:
+				if symbol not in fn and text != "":
+					fn[symbol] = text
+	return(sorted([[symbol, text] for (symbol, text) in fn.items()]))
 
 
 def extract_start_end(daylist):
 	"""from day list, extract start and end days of trains of days"""
-	last_day = 0
-	out = []
-	if daylist:
-		daylist.sort()
-		for i in daylist:
-			if i == daylist[0] or i != last_day+1 and not (last_day == -1 and i == 1):
-				out += [last_day, i]
-			last_day = i
-		out += [i]
-	out = list(dict.fromkeys(out))
-	if 0 in out:
-		out.remove(0)
-	return(out)
+	# days as positions without the absent day 0, i.e., day -1 and day 1 are adjacent
+	positions = [d if d > 0 else d + 1 for d in daylist if d != 0]
+	if not positions:
+		return([])
+	low = min(positions)
+	mask = 0
+	for i in positions:
+		mask |= 1 << (i - low)
+	edges = leading_mask(mask) | trailing_mask(mask)
+	return([i + low if i + low > 0 else i + low - 1 for i, e in enumerate(mask_list(edges, edges.bit_length())) if e])
+
+
+def day_mask(period, daylist):
+	"""return bit mask of the day indices of the days in daylist, see day_index"""
+	start = period['start']
+	duration = period['duration']
+	indices = [d - start - 1 if start < 0 and d > 0 else d - start for d in daylist]
+	if not indices:
+		return(0)
+	if min(indices) < 0 or max(indices) > duration - 1:
+		for d in daylist:
+			day_index(period, d)  # raises the out of range error
+	bits = bytearray(b"0" * duration)
+	for i in indices:
+		bits[duration - 1 - i] = 49  # "1"
+	return(int(bits, 2))
 
 
 def activity_days(period):
 	"""returns a list of boolean values per day to indicate whether there are procedures on the day"""
-	start = period["start"]
-	duration = period["duration"]
-	if start < 0 and start + duration > 0:
-		duration += 1
-	
 	# start and end of period, start and end of trains of procedure days
-	out = [start, start + duration - 1]
+	mask = 1 | 1 << (period['duration'] - 1)
 	for x in ["administrations", "procedures"]:
 		if x in period.keys():
 			for i in period[x]:
 				if "days" in i.keys():
-					temp = decode_daylist(i["days"])
-					out += extract_start_end(temp)
+					temp = day_mask(period, daylist_tuple(i["days"]))
+					mask |= leading_mask(temp) | trailing_mask(temp)
 
 	# include ALL PK days
 	# if "procedures" in period.keys():
@@ -283,14 +359,10 @@ def activity_days(period):
 				duration = i["duration"]
 				if start < 0 and start + duration > 0:
 					duration += 1
-				out += extract_start_end(make_dayrange(start, duration))
+				mask |= day_mask(period, extract_start_end(make_dayrange(start, duration)))
 			elif "days" in i.keys():
-				out += decode_daylist(i["days"])
-	out.sort()
-	temp = [False] * period['duration']
-	for i in list(dict.fromkeys(out)):
-		temp[day_index(period, i)] = True
-	return(temp)
+				mask |= day_mask(period, daylist_tuple(i["days"]))
+	return(mask_list(mask, period['duration']))
 
 
 def normalize_procedure(procedure):
@@ -322,7 +394,7 @@ def unnormalize_procedure(procedure):
 	return(out)
 
 
-def has_timescale(period, caption):
+def has_timescale(period, caption, index=None):
 	"""test if procedure has timescale in the respective period"""
 	out = []
 
@@ -332,19 +404,19 @@ def has_timescale(period, caption):
 				out.append(True)
 		return(out)
 
-	return(True in iterate_over_procedures(period, caption, out, temp))
+	return(True in iterate_over_procedures(period, caption, out, temp, index))
 
 
-def extract_field(period, caption, field):
+def extract_field(period, caption, field, index=None):
 	out = [""] * period['duration']
 
 	def temp(proc, out):
 		val = proc[field] if field in proc.keys() else ""
-		for (day, val) in [(d, val) for d in decode_daylist(proc['days'])]:
+		for (day, val) in [(d, val) for d in daylist_tuple(proc['days'])]:
 			out[day_index(period, day)] = val
 		return(out)
 
-	return(iterate_over_procedures(period, caption, out, temp))
+	return(iterate_over_procedures(period, caption, out, temp, index))
 
 
 def extract_interval(period, caption):
@@ -356,8 +428,8 @@ def extract_interval(period, caption):
 	return(out)
 
 
-def extract_times(period, caption):
-	temp = normalize_procedure(extract_procedure(period, caption))
+def extract_times(period, caption, index=None):
+	temp = normalize_procedure(extract_procedure(period, caption, index))
 	return([(d-rel)*24+t for (d, ts, rel) in temp for t in ts])
 
 
@@ -374,18 +446,133 @@ def day_index(period, day):
 def day_labels(period):
 	temp = [""] * period['duration']
 	if "daylabels" in period.keys():
-		print(f'key daylabels in period {period["caption"]}: {period["daylabels"]}')
-		for i in decode_daylist(period['daylabels']):
+		for i in daylist_tuple(period['daylabels']):
 			temp[day_index(period, i)] = i
 	return(temp)
 
 
 def day_shadings(period):
-	temp = [False] * period['duration']
 	if "dayshading" in period.keys():
-		for i in decode_daylist(period['dayshading']):
-			temp[day_index(period, i)] = True
-	return(temp)
+		return(mask_list(day_mask(period, daylist_tuple(period['dayshading'])), period['duration']))
+	return([False] * period['duration'])
+
+
+# TEXT METRICS
+
+GLYPHS = "".join(chr(i) for i in range(32, 127))
+
+
+def cairo_canvas(font, fontsize):
+	"""return a cairo context with the font selected, for text measurements
+
+	The context draws on an in-memory surface, i.e., measuring text does not write any files.
+	"""
+	import cairo
+	canvas = cairo.Context(cairo.SVGSurface(None, 10, 10))
+	canvas.select_font_face(font, cairo.FONT_SLANT_NORMAL, cairo.FONT_WEIGHT_NORMAL)
+	canvas.set_font_size(fontsize)
+	return(canvas)
+
+
+def cairo_text_extents(font, fontsize):
+	"""return function that measures the ink extents (width, height) of a text with cairo"""
+	canvas = cairo_canvas(font, fontsize)
+	lock = threading.Lock()
+
+	def text_extents(text):
+		with lock:
+			(x, y, width, height, dx, dy) = canvas.text_extents(text)
+		return((width, height))
+	return(text_extents)
+
+
+def cairo_glyph_table(font, fontsize, glyphs=GLYPHS):
+	"""measure individual glyphs with cairo
+
+	:rtype:		dict
+	:return:	tuples of (x_bearing, y_bearing, width, height, x_advance) by glyph
+	"""
+	canvas = cairo_canvas(font, fontsize)
+	return({g: tuple(canvas.text_extents(g)[:5]) for g in glyphs})
+
+
+def glyph_text_extents(table, fallback="X"):
+	"""return function that computes the ink extents (width, height) of a text from a per-glyph table
+
+	The glyphs are placed by their advances, and the extents are the union of their ink boxes. Glyphs not in the table are measured like the fallback glyph.
+	"""
+	def text_extents(text):
+		x = 0
+		left = right = top = bottom = None
+		for g in text:
+			(xb, yb, w, h, dx) = table[g] if g in table else table[fallback]
+			if w or h:
+				left = x + xb if left is None else min(left, x + xb)
+				right = x + xb + w if right is None else max(right, x + xb + w)
+				top = yb if top is None else min(top, yb)
+				bottom = yb + h if bottom is None else max(bottom, yb + h)
+			x += dx
+		if left is None:
+			return((0, 0))
+		return((right - left, bottom - top))
+	return(text_extents)
+
+
+def load_glyph_table(path, font, fontsize):
+	"""return the glyph table for font and font size from a json file of glyph tables
+
+	Tables missing in the file are measured with cairo and added to the file, i.e., cairo is only needed the first time a font and size are used.
+	"""
+	import tempfile
+	path = pathlib.Path(path)
+	try:
+		tables = json.loads(path.read_text())
+	except FileNotFoundError:
+		tables = {}
+	key = f'{font}|{fontsize}'
+	if key not in tables:
+		tables[key] = cairo_glyph_table(font, fontsize)
+		(fd, temp) = tempfile.mkstemp(dir=path.resolve().parent, suffix=".tmp")
+		with os.fdopen(fd, "w") as f:
+			json.dump(tables, f)
+		os.chmod(temp, file_mode())
+		os.replace(temp, path)
+	return({g: tuple(v) for g, v in tables[key].items()})
+
+
+def glyph_table_extents(font, fontsize, glyph_table=""):
+	"""return function that computes text extents from a glyph table, measured once with cairo or read from the glyph_table file"""
+	if glyph_table:
+		return(glyph_text_extents(load_glyph_table(glyph_table, font, fontsize)))
+	return(glyph_text_extents(cairo_glyph_table(font, fontsize)))
+
+
+METRICS_ENGINES = {"cairo": cairo_text_extents, "glyphs": glyph_table_extents}
+
+
+def make_text_functions(text_extents, cache_size=4096):
+	"""return (textwidth_function, textheight_function) sharing a LRU cache over a text extents function"""
+	extents = functools.lru_cache(maxsize=cache_size)(text_extents)
+
+	def textwidth_function(text):
+		return(extents(text)[0])
+
+	def textheight_function(text):
+		return(extents(text)[1])
+	return((textwidth_function, textheight_function))
+
+
+@functools.lru_cache(maxsize=None)
+def font_metrics(font, fontsize, engine="cairo", glyph_table=""):
+	"""return cached text functions for a font, font size and metrics engine ('cairo' or 'glyphs')
+
+	The text functions are created once per process and can be shared between renders and threads. The glyphs engine reads its measurements from the glyph_table file, if given (see load_glyph_table).
+	"""
+	if engine not in METRICS_ENGINES:
+		raise ValueError(f'unknown text metrics engine "{engine}", use one of {", ".join(METRICS_ENGINES)}')
+	if engine == "glyphs":
+		return(make_text_functions(glyph_table_extents(font, fontsize, glyph_table)))
+	return(make_text_functions(METRICS_ENGINES[engine](font, fontsize)))
 
 
 # LOW-LEVEL RENDERING FUNCTIONS
@@ -428,17 +615,27 @@ def svg_path(x, y, points, lwd=1, size=1, fill=False, dashed=False, fill_color="
 	return(out)
 
 
-def svg_symbol(x, y, width, symbol, size=1, fill=False, fill_color="none", **kwargs):
+def symbol_shape(width, symbol, size=1):
+	"""return the outline of a path symbol as (points, scale), or None if the symbol is not a path"""
 	if symbol == "diamond":
-		return svg_path(x, y, [(0, -0.5), (0.25, 0), (0, 0.5), (-0.25, 0)], size=size * 1.4, fill=fill, fill_color=fill_color, **kwargs)
+		return(([(0, -0.5), (0.25, 0), (0, 0.5), (-0.25, 0)], size * 1.4))
 	elif symbol == "block":
 		w = width / size / 1.5 * .7
-		return svg_path(x, y, [(w/-2, -.25), (w/2, -.25), (w/2, .25), (-w/2, .25)], size=size*1.5, fill=fill, fill_color=fill_color, **kwargs)
+		return(([(w/-2, -.25), (w/2, -.25), (w/2, .25), (-w/2, .25)], size*1.5))
 	elif symbol == "arrow":
-		return svg_path(x, y, [(-0.03, -0.5), (0.03, -0.5), (0.03, 0), (0.1875, 0), (0.0, 0.5), (-0.1875, 0), (-0.03, 0)], size=size*1.2, fill=True, fill_color="black", **kwargs)
-	elif symbol == "circle":
+		return(([(-0.03, -0.5), (0.03, -0.5), (0.03, 0), (0.1875, 0), (0.0, 0.5), (-0.1875, 0), (-0.03, 0)], size*1.2))
+	return(None)
+
+
+def svg_symbol(x, y, width, symbol, size=1, fill=False, fill_color="none", **kwargs):
+	if symbol == "circle":
 		return svg_circle(x, y, width/2*size, fill_color=fill_color, **kwargs)
-	return ""
+	shape = symbol_shape(width, symbol, size)
+	if shape is None:
+		return ""
+	if symbol == "arrow":
+		(fill, fill_color) = (True, "black")
+	return svg_path(x, y, shape[0], size=shape[1], fill=fill, fill_color=fill_color, **kwargs)
 
 
 def svg_open_bracket(x, y, height, width, xpadding=0, radius=3, lwd=1.2):
@@ -483,9 +680,428 @@ def svg_bracket_down(xstart, xend, y, height, lwd=1.2):
 	return(out)
 
 
-def procedure_symbols(period, caption, default="diamond"):
+# SVG OUTPUT
+
+class SvgWriter:
+	"""collect svg elements in layered buffers and write them out once
+
+	Each element goes to one of the LAYERS, and the layers are written in this order, i.e., later layers are drawn on top. The underlay holds the period decorations, below the day shading of the background. The drawing methods take the arguments of the respective svg_* function plus the layer.
+	"""
+	LAYERS = ("underlay", "background", "grid", "symbols", "text")
+
+	def __init__(self):
+		self.layers = {layer: [] for layer in self.LAYERS}
+
+	def add(self, fragment, layer="symbols"):
+		if fragment:
+			self.layers[layer].append(fragment)
+
+	def line(self, x1, y1, x2, y2, layer="symbols", **kwargs):
+		self.add(svg_line(x1, y1, x2, y2, **kwargs), layer)
+
+	def rect(self, x, y, w, h, layer="symbols", **kwargs):
+		self.add(svg_rect(x, y, w, h, **kwargs), layer)
+
+	def circle(self, x, y, r, layer="symbols", **kwargs):
+		self.add(svg_circle(x, y, r, **kwargs), layer)
+
+	def text(self, x, y, text, layer="text", **kwargs):
+		self.add(svg_text(x, y, text, **kwargs), layer)
+
+	def symbol(self, x, y, width, symbol, layer="symbols", **kwargs):
+		self.add(svg_symbol(x, y, width, symbol, **kwargs), layer)
+
+	def open_bracket(self, x, y, height, width, layer="symbols", **kwargs):
+		self.add(svg_open_bracket(x, y, height, width, **kwargs), layer)
+
+	def close_bracket(self, x, y, height, width, layer="symbols", **kwargs):
+		self.add(svg_close_bracket(x, y, height, width, **kwargs), layer)
+
+	def curly_up(self, xstart, xend, y, layer="symbols", **kwargs):
+		self.add(svg_curly_up(xstart, xend, y, **kwargs), layer)
+
+	def bracket_down(self, xstart, xend, y, height, layer="symbols", **kwargs):
+		self.add(svg_bracket_down(xstart, xend, y, height, **kwargs), layer)
+
+	def position(self):
+		"""return the current position in the layers, see since"""
+		return({layer: len(self.layers[layer]) for layer in self.LAYERS})
+
+	def since(self, position):
+		"""return the elements added after position as fragment that can be placed again, see place"""
+		return(tuple((layer, tuple(self.layers[layer][position[layer]:])) for layer in self.LAYERS if len(self.layers[layer]) > position[layer]))
+
+	def place(self, fragment, dx=0, dy=0):
+		"""add a copy of a fragment, translated by dx and dy"""
+		for (layer, elements) in fragment:
+			self.add(f'<g transform="translate({dx} {dy})">\n{"".join(elements)}</g>\n', layer)
+
+	def fragments(self):
+		for layer in self.LAYERS:
+			yield from self.layers[layer]
+
+	def write(self, stream):
+		stream.writelines(self.fragments())
+
+	def getvalue(self):
+		return("".join(self.fragments()))
+
+	def document(self, width, height, title="", font="Arial", fontsize=14, stream=None):
+		"""return the svg document as string or, if stream is given, write it to the stream (a text file object)"""
+		header = f'<svg width="{width}" height="{height}" xmlns="http://www.w3.org/2000/svg">\n<style>text {{font-family: {font}; font-size: {fontsize}px ;}}</style>\n<desc>Trial design autogenerated by td.py version {__version__} ({__date__}), author: Rainer Strotmann</desc><title>{title}</title>'
+		if stream is None:
+			return(header + self.getvalue() + '</svg>')
+		stream.write(header)
+		self.write(stream)
+		stream.write('</svg>')
+
+
+# OUTLINES OF BRACKETS AND BRACES
+# open paths as list of ("M", x, y), ("L", x, y) and svg arc ("A", r, large_arc, sweep, x, y) segments
+
+def open_bracket_segments(x, y, height, width, xpadding=0, radius=3):
+	(h, w, r, d) = (height, width, radius, xpadding)
+	return([
+		("M", x-w/2+r-d, y-h/2), ("A", r, 0, 0, x-w/2-d, y-h/2+r),
+		("L", x-w/2-d, y+h/2-r), ("A", r, 0, 0, x-w/2+r-d, y+h/2)])
+
+
+def close_bracket_segments(x, y, height, width, xpadding=0, radius=3):
+	(h, w, r, d) = (height, width, radius, xpadding)
+	return([
+		("M", x+w/2-r+d, y-h/2), ("A", r, 0, 1, x+w/2+d, y-h/2+r),
+		("L", x+w/2+d, y+h/2-r), ("A", r, 0, 1, x+w/2-r+d, y+h/2)])
+
+
+def curly_up_segments(xstart, xend, y, radius=8):
+	xcenter = xstart + (xend - xstart)/2
+	return([
+		("M", xstart, y), ("A", radius, 0, 0, xstart+radius, y+radius),
+		("L", xcenter-radius, y+radius), ("A", radius, 0, 1, xcenter, y+2*radius),
+		("A", radius, 0, 1, xcenter+radius, y+radius), ("L", xend-radius, y+radius),
+		("A", radius, 0, 0, xend, y)])
+
+
+# COMPACT SVG OUTPUT
+
+class CompactSvgWriter(SvgWriter):
+	"""svg writer for compact output
+
+	Styles are written once as css classes, path symbols and placed fragments are defined once and placed with <use>, and coordinates are rounded to precision decimals. If gzipped, the document is returned as gzip-compressed bytes (.svgz).
+	"""
+	def __init__(self, precision=2, gzipped=False):
+		super().__init__()
+		self.precision = precision
+		self.gzipped = gzipped
+		self.styles = {}
+		self.defs = {}
+		self.groups = {}
+
+	def num(self, value):
+		"""format number with at most precision decimals"""
+		temp = f'{value:.{self.precision}f}'.rstrip("0").rstrip(".") if self.precision > 0 else f'{value:.0f}'
+		return("0" if temp == "-0" else temp)
+
+	def css_class(self, lwd=1, line_color="black", fill_color="none", dashes=None):
+		"""return the css class for a stroke and fill style"""
+		style = f'stroke:{line_color};stroke-width:{self.num(lwd)};fill:{fill_color}'
+		if dashes:
+			style += f';stroke-dasharray:{" ".join(self.num(i) for i in dashes)}'
+		if style not in self.styles:
+			self.styles[style] = f's{len(self.styles)}'
+		return(self.styles[style])
+
+	def line(self, x1, y1, x2, y2, lwd=1, color="black", dashed=False, layer="symbols"):
+		n = self.num
+		self.add(f'<line x1="{n(x1)}" y1="{n(y1)}" x2="{n(x2)}" y2="{n(y2)}" class="{self.css_class(lwd, color, dashes=[lwd*3, lwd*3] if dashed else None)}"/>\n', layer)
+
+	def rect(self, x, y, w, h, lwd=1, fill_color="none", line_color="black", layer="symbols"):
+		n = self.num
+		self.add(f'<rect x="{n(x)}" y="{n(y)}" width="{n(w)}" height="{n(h)}" class="{self.css_class(lwd, line_color, fill_color)}"/>\n', layer)
+
+	def circle(self, x, y, r, lwd=1.2, fill_color="none", line_color="black", layer="symbols"):
+		n = self.num
+		self.add(f'<circle cx="{n(x)}" cy="{n(y)}" r="{n(r)}" class="{self.css_class(lwd, line_color, fill_color)}"/>\n', layer)
+
+	def text(self, x, y, text, css_class="", color="", layer="text"):
+		attributes = f' class="{css_class}"' if css_class else f' fill="{color}"' if color else ""
+		self.add(f'<text x="{self.num(x)}" y="{self.num(y)}"{attributes}>{text}</text>\n', layer)
+
+	def symbol(self, x, y, width, symbol, size=1, fill=False, fill_color="none", lwd=None, dashed=False, title="", layer="symbols", **kwargs):
+		if symbol == "circle":
+			# circles and paths have different default line widths, see svg_circle and svg_path
+			if lwd is not None:
+				kwargs["lwd"] = lwd
+			self.circle(x, y, width/2*size, fill_color=fill_color, layer=layer, **kwargs)
+			return
+		if lwd is None:
+			lwd = 1
+		shape = symbol_shape(width, symbol, size)
+		if shape is None:
+			return
+		if symbol == "arrow":
+			fill_color = "black"
+		(points, scale) = shape
+		(x1, y1) = points[-1]
+		d = f'M{self.num(x1*scale)} {self.num(y1*scale)}' + "".join(f'L{self.num(x2*scale)} {self.num(y2*scale)}' for (x2, y2) in points) + "Z"
+		definition = f'<path d="{d}" class="{self.css_class(lwd, "black", fill_color, [2.5, 2.5] if dashed else None)}"'
+		if definition not in self.defs:
+			self.defs[definition] = f'y{len(self.defs)}'
+		self.add(f'<use xlink:href="#{self.defs[definition]}" x="{self.num(x)}" y="{self.num(y)}"/>\n', layer)
+
+	def place(self, fragment, dx=0, dy=0):
+		for (layer, elements) in fragment:
+			group = "".join(elements)
+			if group not in self.groups:
+				self.groups[group] = f'g{len(self.groups)}'
+			self.add(f'<use xlink:href="#{self.groups[group]}" x="{self.num(dx)}" y="{self.num(dy)}"/>\n', layer)
+
+	def segments(self, segments, lwd=1.2, layer="symbols"):
+		"""add an open path of outline segments"""
+		n = self.num
+		d = ""
+		for segment in segments:
+			if segment[0] == "A":
+				(r, large_arc, sweep, x, y) = segment[1:]
+				d += f'A{n(r)} {n(r)} 0 {large_arc} {sweep} {n(x)} {n(y)}'
+			else:
+				d += f'{segment[0]}{n(segment[1])} {n(segment[2])}'
+		self.add(f'<path d="{d}" class="{self.css_class(lwd)}"/>\n', layer)
+
+	def open_bracket(self, x, y, height, width, xpadding=0, radius=3, lwd=1.2, layer="symbols"):
+		self.segments(open_bracket_segments(x, y, height, width, xpadding, radius), lwd, layer)
+
+	def close_bracket(self, x, y, height, width, xpadding=0, radius=3, lwd=1.2, layer="symbols"):
+		self.segments(close_bracket_segments(x, y, height, width, xpadding, radius), lwd, layer)
+
+	def curly_up(self, xstart, xend, y, radius=8, lwd=1.2, layer="symbols"):
+		self.segments(curly_up_segments(xstart, xend, y, radius), lwd, layer)
+
+	def bracket_down(self, xstart, xend, y, height, lwd=1.2, layer="symbols"):
+		self.line(xstart, y, xend, y, lwd=lwd, layer=layer)
+		self.line(xstart, y, xstart, y + height, lwd=lwd, layer=layer)
+		self.line(xend, y, xend, y + height, lwd=lwd, layer=layer)
+
+	def document(self, width, height, title="", font="Arial", fontsize=14, stream=None):
+		"""return the svg document as string or, if gzipped, as bytes, or write it to the stream (a text file object, or a binary file object if gzipped)"""
+		styles = "".join(f'.{name}{{{style}}}' for (style, name) in self.styles.items())
+		defs = "".join(f'{definition} id="{name}"/>' for (definition, name) in self.defs.items())
+		defs += "".join(f'<g id="{name}">{group}</g>' for (group, name) in self.groups.items())
+		header = f'<svg width="{self.num(width)}" height="{self.num(height)}" xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink">\n<style>text{{font-family:{font};font-size:{fontsize}px}}{styles}</style>\n<desc>Trial design autogenerated by td.py version {__version__} ({__date__}), author: Rainer Strotmann</desc><title>{title}</title>'
+		if defs:
+			header += f'<defs>{defs}</defs>\n'
+		if not self.gzipped:
+			if stream is None:
+				return(header + self.getvalue() + '</svg>')
+			stream.write(header)
+			self.write(stream)
+			stream.write('</svg>')
+			return
+		import gzip
+		import io
+		buffer = io.BytesIO()
+		with gzip.GzipFile(fileobj=buffer, mode="wb", mtime=0) as f:  # gzip.compress takes no mtime before Python 3.8
+			f.write((header + self.getvalue() + '</svg>').encode("utf-8"))
+		svg_out = buffer.getvalue()
+		if stream is None:
+			return(svg_out)
+		stream.write(svg_out)
+
+
+# CAIRO OUTPUT
+
+COLORS = {"black": (0, 0, 0), "white": (1, 1, 1), "red": (1, 0, 0), "cornsilk": (1, 0.973, 0.863), "lightgray": (0.827, 0.827, 0.827)}
+
+
+def cairo_color(color):
+	"""convert svg color name or #rgb/#rrggbb value to (r, g, b), or None for no color"""
+	if color == "none":
+		return(None)
+	if color.startswith("#"):
+		digits = color[1:] if len(color) == 7 else "".join(c * 2 for c in color[1:4])
+		return(tuple(int(digits[i:i+2], 16) / 255 for i in (0, 2, 4)))
+	return(COLORS.get(color, (0, 0, 0)))
+
+
+def svg_arc_center(x1, y1, x2, y2, r, large_arc=0, sweep=0):
+	"""convert circular svg arc from (x1, y1) to (x2, y2) to center parametrization (cx, cy, r, angle1, angle2)
+
+	See the SVG specification, appendix F.6.5. The radius is scaled up if it is too small to connect the end points.
+	"""
+	import math
+	(dx, dy) = ((x1 - x2) / 2, (y1 - y2) / 2)
+	d2 = dx**2 + dy**2
+	if d2 == 0:
+		return((x1, y1, 0, 0, 0))
+	r = max(r, math.sqrt(d2))
+	coef = math.sqrt(max(0, (r**2 - d2) / d2)) * (-1 if large_arc == sweep else 1)
+	(cx, cy) = (coef * dy + (x1 + x2) / 2, -coef * dx + (y1 + y2) / 2)
+	return((cx, cy, r, math.atan2(y1 - cy, x1 - cx), math.atan2(y2 - cy, x2 - cx)))
+
+
+class CairoWriter:
+	"""draw the elements on a cairo surface, for pdf, png or svg output
+
+	The drawing methods take the same arguments as those of SvgWriter. The elements are recorded per layer and drawn once the size of the figure is known (see document).
+	"""
+	LAYERS = SvgWriter.LAYERS
+	FORMATS = ("pdf", "png", "svg")
+
+	def __init__(self, output_format="pdf", scale=1):
+		if output_format not in self.FORMATS:
+			raise ValueError(f'unknown output format "{output_format}", use one of {", ".join(self.FORMATS)}')
+		self.output_format = output_format
+		self.scale = scale
+		self.layers = {layer: [] for layer in self.LAYERS}
+
+	def add(self, operation, layer="symbols"):
+		"""add drawing operation, a function of the cairo context"""
+		self.layers[layer].append(operation)
+
+	def position(self):
+		return({layer: len(self.layers[layer]) for layer in self.LAYERS})
+
+	def since(self, position):
+		return(tuple((layer, tuple(self.layers[layer][position[layer]:])) for layer in self.LAYERS if len(self.layers[layer]) > position[layer]))
+
+	def place(self, fragment, dx=0, dy=0):
+		for (layer, operations) in fragment:
+			def operation(ctx, operations=operations):
+				ctx.save()
+				ctx.translate(dx, dy)
+				for op in operations:
+					op(ctx)
+				ctx.restore()
+			self.add(operation, layer)
+
+	@staticmethod
+	def paint(ctx, lwd=1, fill_color="none", line_color="black", dashes=None):
+		"""fill and stroke the current path"""
+		fill = cairo_color(fill_color)
+		if fill is not None:
+			ctx.set_source_rgb(*fill)
+			ctx.fill_preserve()
+		stroke = cairo_color(line_color)
+		if lwd and stroke is not None:
+			ctx.set_source_rgb(*stroke)
+			ctx.set_line_width(lwd)
+			ctx.set_dash(dashes or [])
+			ctx.stroke_preserve()
+		ctx.new_path()
+
+	def line(self, x1, y1, x2, y2, lwd=1, color="black", dashed=False, layer="symbols"):
+		def operation(ctx):
+			ctx.move_to(x1, y1)
+			ctx.line_to(x2, y2)
+			self.paint(ctx, lwd, line_color=color, dashes=[lwd*3, lwd*3] if dashed else None)
+		self.add(operation, layer)
+
+	def rect(self, x, y, w, h, lwd=1, fill_color="none", line_color="black", layer="symbols"):
+		def operation(ctx):
+			ctx.rectangle(x, y, w, h)
+			self.paint(ctx, lwd, fill_color, line_color)
+		self.add(operation, layer)
+
+	def circle(self, x, y, r, lwd=1.2, fill_color="none", line_color="black", layer="symbols"):
+		import math
+		def operation(ctx):
+			ctx.new_sub_path()
+			ctx.arc(x, y, r, 0, 2 * math.pi)
+			self.paint(ctx, lwd, fill_color, line_color)
+		self.add(operation, layer)
+
+	def text(self, x, y, text, css_class="", color="", layer="text"):
+		def operation(ctx):
+			ctx.set_source_rgb(*cairo_color(color or "black"))
+			ctx.move_to(x, y)
+			ctx.show_text(text)
+			ctx.new_path()
+		self.add(operation, layer)
+
+	def path(self, x, y, points, lwd=1, size=1, fill=False, dashed=False, fill_color="none", title="", layer="symbols"):
+		def operation(ctx):
+			(x1, y1) = points[-1]
+			ctx.move_to(x1*size+x, y1*size+y)
+			for (x2, y2) in points:
+				ctx.line_to(x2*size+x, y2*size+y)
+			ctx.close_path()
+			self.paint(ctx, lwd, fill_color, dashes=[2.5, 2.5] if dashed else None)
+		self.add(operation, layer)
+
+	def symbol(self, x, y, width, symbol, size=1, fill=False, fill_color="none", layer="symbols", **kwargs):
+		if symbol == "circle":
+			self.circle(x, y, width/2*size, fill_color=fill_color, layer=layer, **kwargs)
+			return
+		shape = symbol_shape(width, symbol, size)
+		if shape is not None:
+			if symbol == "arrow":
+				(fill, fill_color) = (True, "black")
+			self.path(x, y, shape[0], size=shape[1], fill=fill, fill_color=fill_color, layer=layer, **kwargs)
+
+	def arcs(self, segments, lwd=1.2, layer="symbols"):
+		"""stroke an open path of ("M", x, y), ("L", x, y) and svg arc ("A", r, large_arc, sweep, x, y) segments"""
+		def operation(ctx):
+			for segment in segments:
+				if segment[0] == "M":
+					ctx.move_to(*segment[1:])
+				elif segment[0] == "L":
+					ctx.line_to(*segment[1:])
+				else:
+					(r, large_arc, sweep, x2, y2) = segment[1:]
+					(x1, y1) = ctx.get_current_point()
+					(cx, cy, r, a1, a2) = svg_arc_center(x1, y1, x2, y2, r, large_arc, sweep)
+					(ctx.arc if sweep else ctx.arc_negative)(cx, cy, r, a1, a2)
+			self.paint(ctx, lwd)
+		self.add(operation, layer)
+
+	def open_bracket(self, x, y, height, width, xpadding=0, radius=3, lwd=1.2, layer="symbols"):
+		self.arcs(open_bracket_segments(x, y, height, width, xpadding, radius), lwd, layer)
+
+	def close_bracket(self, x, y, height, width, xpadding=0, radius=3, lwd=1.2, layer="symbols"):
+		self.arcs(close_bracket_segments(x, y, height, width, xpadding, radius), lwd, layer)
+
+	def curly_up(self, xstart, xend, y, radius=8, lwd=1.2, layer="symbols"):
+		self.arcs(curly_up_segments(xstart, xend, y, radius), lwd, layer)
+
+	def bracket_down(self, xstart, xend, y, height, lwd=1.2, layer="symbols"):
+		self.line(xstart, y, xend, y, lwd=lwd, layer=layer)
+		self.line(xstart, y, xstart, y + height, lwd=lwd, layer=layer)
+		self.line(xend, y, xend, y + height, lwd=lwd, layer=layer)
+
+	def document(self, width, height, title="", font="Arial", fontsize=14, stream=None):
+		"""draw the figure and return it as bytes or, if stream is given, write it to the stream (a binary file object)"""
+		import cairo
+		import io
+		target = io.BytesIO() if stream is None else stream
+		(w, h) = (width * self.scale, height * self.scale)
+		if self.output_format == "png":
+			surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, max(1, int(w + 0.5)), max(1, int(h + 0.5)))
+		elif self.output_format == "pdf":
+			surface = cairo.PDFSurface(target, w, h)
+			if title and hasattr(surface, "set_metadata"):
+				surface.set_metadata(cairo.PDF_METADATA_TITLE, title)
+		else:
+			surface = cairo.SVGSurface(target, w, h)
+		ctx = cairo.Context(surface)
+		ctx.scale(self.scale, self.scale)
+		if self.output_format == "png":
+			ctx.set_source_rgb(1, 1, 1)
+			ctx.paint()
+		ctx.select_font_face(font, cairo.FONT_SLANT_NORMAL, cairo.FONT_WEIGHT_NORMAL)
+		ctx.set_font_size(fontsize)
+		for layer in self.LAYERS:
+			for operation in self.layers[layer]:
+				operation(ctx)
+		if self.output_format == "png":
+			surface.write_to_png(target)
+		surface.finish()
+		if stream is None:
+			return(target.getvalue())
+
+
+def procedure_symbols(period, caption, default="diamond", index=None):
 	out = [""] * (period['duration'])
-	for (d, t, rel) in normalize_procedure(extract_procedure(period, caption)):
+	for (d, t, rel) in normalize_procedure(extract_procedure(period, caption, index)):
 		if len(t) > 1:
 			symbol = "block"
 		else:
@@ -494,32 +1110,70 @@ def procedure_symbols(period, caption, default="diamond"):
 	return(out)
 
 
-# FUNCTIONS THAT RELY ON DAYWIDTH_FUNCTION
+# PERIOD LAYOUT
 
-def period_width(period, day_width_function):
-	return(sum(day_width_function(period)))
+class PeriodLayout:
+	"""day layout of a period, compiled once per render
+
+	All x-coordinates are relative to the start of the period. The layout is immutable and can be shared by all rendering functions.
+	"""
+	__slots__ = ("widths", "starts", "centers", "ends", "width", "labels", "shadings")
+
+	def __init__(self, period, widths):
+		starts = []
+		acc = 0
+		for w in widths:
+			starts.append(acc)
+			acc += w
+		values = {
+			"widths": tuple(widths),
+			"starts": tuple(starts),
+			"centers": tuple(s + w / 2 for s, w in zip(starts, widths)),
+			"ends": tuple(s + w for s, w in zip(starts, widths)),
+			"width": sum(widths),
+			"labels": tuple(day_labels(period)),
+			"shadings": tuple(day_shadings(period))}
+		for k, v in values.items():
+			object.__setattr__(self, k, v)
+
+	def __setattr__(self, name, value):
+		raise AttributeError(f'{type(self).__name__} is immutable')
+
+
+def make_layout_function(daywidth_function):
+	"""return function that compiles the layout of a period on first use and returns the cached layout afterwards
+
+	The cache is keyed by period identity and is only valid while the periods of one render exist.
+	"""
+	layouts = {}
 
+	def layout_function(period):
+		key = id(period)
+		if key not in layouts:
+			layouts[key] = PeriodLayout(period, daywidth_function(period))
+		return(layouts[key])
+	return(layout_function)
 
-def period_day_starts(period, xoffset, daywidth_function):
+
+# FUNCTIONS THAT RELY ON LAYOUT_FUNCTION
+
+def period_width(period, layout_function):
+	return(layout_function(period).width)
+
+
+def period_day_starts(period, xoffset, layout_function):
 	"""return list of x-coordinates for day starts"""
-	out = [xoffset]
-	acc = xoffset
-	for i in daywidth_function(period):
-		acc += i
-		out.append(acc)
-	return out[:-1]
+	return([xoffset + i for i in layout_function(period).starts])
 
 
-def period_day_centers(period, xoffset, daywidth_function):
+def period_day_centers(period, xoffset, layout_function):
 	"""return list of x-coordinates for day centers"""
-	return([start + width / 2 for start, width in zip(period_day_starts(period, xoffset, daywidth_function), daywidth_function(period))])
+	return([xoffset + i for i in layout_function(period).centers])
 
 
-def period_day_ends(period, xoffset, daywidth_function):
+def period_day_ends(period, xoffset, layout_function):
 	"""return list of x-coordinates for day ends"""
-	starts = period_day_starts(period, xoffset, daywidth_function)
-	widths = daywidth_function(period)
-	return([s+w for s, w in zip(starts, widths)])
+	return([xoffset + i for i in layout_function(period).ends])
 
 
 def ensure_list(period, key):
@@ -535,150 +1189,144 @@ def ensure_list(period, key):
 
 # FUNCTIONS THAT RELY ON METRICS
 
-def render_dummy(period, xoffset, yoffset, lineheight, metrics):
-	"""render bounding box for visual debugging purposes. Output is svg code only."""
-	daywidth_function = metrics[0]
-	return(svg_rect(xoffset, yoffset, period_width(period, daywidth_function), lineheight, lwd=0, fill_color="cornsilk"))
+def render_dummy(out, period, xoffset, yoffset, lineheight, metrics):
+	"""render bounding box for visual debugging purposes"""
+	layout_function = metrics[0]
+	out.rect(xoffset, yoffset, period_width(period, layout_function), lineheight, lwd=0, fill_color="cornsilk", layer="background")
 
 
-def render_daygrid(period, caption, xoffset, yoffset, height, metrics, style, first_pass=True):
-	"""render svg output for the day grid for a period. Output is [svg_output, height]"""
-	(daywidth_function, textwidth_function, textheight_function) = metrics
+def render_daygrid(out, period, caption, xoffset, yoffset, height, metrics, style, first_pass=True, index=None):
+	"""render svg output for the day grid for a period. Output is the height"""
+	(layout_function, textwidth_function, textheight_function) = metrics
 	(periodspacing, lineheight, ypadding, lwd, ellipsis, debug) = style
 
-	svg_out = ""
 	y = yoffset
 
 	if debug:
-		svg_out += render_dummy(period, xoffset, yoffset, height, metrics)
-
-	print(day_labels(period))
+		render_dummy(out, period, xoffset, yoffset, height, metrics)
 
-	for start, width, center, label, shading in zip(period_day_starts(period, xoffset, daywidth_function), daywidth_function(period), period_day_centers(period, xoffset, daywidth_function), day_labels(period), day_shadings(period)):
+	layout = layout_function(period)
+	for start, width, center, label, shading in zip(period_day_starts(period, xoffset, layout_function), layout.widths, period_day_centers(period, xoffset, layout_function), layout.labels, layout.shadings):
 		if shading:
-			svg_out += svg_rect(start, y, width, height, lwd=0, fill_color="lightgray")
+			out.rect(start, y, width, height, lwd=0, fill_color="lightgray", layer="background")
 		if width > textwidth_function("XX")/3:
-			svg_out += svg_rect(start, y, width, height, lwd=lwd)
+			out.rect(start, y, width, height, lwd=lwd, layer="grid")
 		else:
-			svg_out += svg_line(start, y, start+width, y, lwd=lwd, dashed=True)
-			svg_out += svg_line(start, y+height, start+width, y+height, lwd=lwd, dashed=True)
+			out.line(start, y, start+width, y, lwd=lwd, dashed=True, layer="grid")
+			out.line(start, y+height, start+width, y+height, lwd=lwd, dashed=True, layer="grid")
 		label = str(label)
 		delta = textwidth_function("1")*.5 if label and label[0] == "1" else 0
 		if width > textwidth_function(str(label)):
-			svg_out += svg_text(center - textwidth_function(str(label)) / 2-delta, yoffset + height - (height- textheight_function("X")) / 2, str(label))
-	return([svg_out, height+ypadding*2])
+			out.text(center - textwidth_function(str(label)) / 2-delta, yoffset + height - (height- textheight_function("X")) / 2, str(label))
+	return(height+ypadding*2)
 
 
-def render_periodcaption(period, caption, xoffset, yoffset, height, metrics, style, first_pass=True):
-	"""render caption for period. The 'caption' input is ignored and the caption field of the input period is used. Output is [svg_output, height]"""
-	(daywidth_function, textwidth_function, textheight_function) = metrics
+def render_periodcaption(out, period, caption, xoffset, yoffset, height, metrics, style, first_pass=True, index=None):
+	"""render caption for period. The 'caption' input is ignored and the caption field of the input period is used. Output is the height"""
+	(layout_function, textwidth_function, textheight_function) = metrics
 	(periodspacing, lineheight, ypadding, lwd, ellipsis, debug) = style
 
-	svg_out = ""
 	if debug:
-		svg_out += render_dummy(period, xoffset, yoffset, height, metrics)
-	xcenter = xoffset + period_width(period, daywidth_function)/2
-	svg_out += svg_text(xcenter - textwidth_function(str(period['caption']))/2, yoffset+ height - (height-textheight_function("X"))/2, str(period['caption']))
-	return([svg_out, height+ypadding/2])
+		render_dummy(out, period, xoffset, yoffset, height, metrics)
+	xcenter = xoffset + period_width(period, layout_function)/2
+	out.text(xcenter - textwidth_function(str(period['caption']))/2, yoffset+ height - (height-textheight_function("X"))/2, str(period['caption']))
+	return(height+ypadding/2)
 
 
-def render_procedure(period, caption, xoffset, yoffset, lineheight, metrics, style, default_symbol="diamond", first_pass=True):
-	"""render procedure. Output is [svg_output, height]"""
-	(daywidth_function, textwidth_function, textheight_function) = metrics
+def render_procedure(out, period, caption, xoffset, yoffset, lineheight, metrics, style, default_symbol="diamond", first_pass=True, index=None):
+	"""render procedure. Output is the height"""
+	(layout_function, textwidth_function, textheight_function) = metrics
 	(periodspacing, lineheight, ypadding, lwd, ellipsis, debug) = style
 
-	svg_out = ""
 	if debug:
-		svg_out += render_dummy(period, xoffset, yoffset, lineheight, metrics)
+		render_dummy(out, period, xoffset, yoffset, lineheight, metrics)
 
 	y = yoffset + lineheight/2  # center of the line
 	if first_pass:
-		svg_out += svg_text(5, y + textheight_function(caption) * (1/2 - 0.1), caption)
+		out.text(5, y + textheight_function(caption) * (1/2 - 0.1), caption)
 
-	centers = period_day_centers(period, xoffset, daywidth_function)
-	widths = daywidth_function(period)
-	brackets = extract_field(period, caption, "decoration")
-	symbols = procedure_symbols(period, caption, default_symbol)
-	dlabels = day_labels(period)
-	values = extract_field(period, caption, "value")
-	ellipses = [True if (s!="" and w < textwidth_function("XX")) else False for (s, l, w) in zip(symbols, dlabels, widths)]
+	centers = period_day_centers(period, xoffset, layout_function)
+	widths = layout_function(period).widths
+	brackets = extract_field(period, caption, "decoration", index)
+	symbols = procedure_symbols(period, caption, default_symbol, index)
+	values = extract_field(period, caption, "value", index)
+	ellipses = [True if (s!="" and w < textwidth_function("XX")) else False for (s, w) in zip(symbols, widths)]
 
 	for p, w, s, b, e, v in zip(centers, widths, symbols, brackets, ellipses, values):
 		if s:
 			if e and b=="" and ellipsis:
-				svg_out += svg_circle(p, y, lineheight/30, fill_color="black")
+				out.circle(p, y, lineheight/30, fill_color="black")
 			elif v != "":
 				if v == 0:
-					svg_out += svg_symbol(p, y, w*.5, "circle", fill=False, fill_color="none", lwd=lwd)
+					out.symbol(p, y, w*.5, "circle", fill=False, fill_color="none", lwd=lwd)
 				else:
-					svg_out += svg_symbol(p, y, w*.5, "circle", fill=True, fill_color="black")
+					out.symbol(p, y, w*.5, "circle", fill=True, fill_color="black")
 			else:
-				svg_out += svg_symbol(p, y, w, s, size=textheight_function("X"), lwd=lwd, title=caption)
+				out.symbol(p, y, w, s, size=textheight_function("X"), lwd=lwd, title=caption)
 				if b=="bracketed":
-					svg_out += svg_open_bracket(p, y, lineheight, w*.8, xpadding=0, radius=lineheight/8, lwd=lwd)
-					svg_out += svg_close_bracket(p, y, lineheight, w*.8, xpadding=0, radius=lineheight/8, lwd=lwd)
+					out.open_bracket(p, y, lineheight, w*.8, xpadding=0, radius=lineheight/8, lwd=lwd)
+					out.close_bracket(p, y, lineheight, w*.8, xpadding=0, radius=lineheight/8, lwd=lwd)
 
-	return([svg_out, lineheight+ypadding])
+	return(lineheight+ypadding)
 
 
-def render_labels_footnotes(period, caption, xoffset, yoffset, linheight, metrics, style, footnotes=False):
-	(daywidth_function, textwidth_function, textheight_function) = metrics
+def render_labels_footnotes(out, period, caption, xoffset, yoffset, linheight, metrics, style, footnotes=False, index=None):
+	(layout_function, textwidth_function, textheight_function) = metrics
 	(periodspacing, lineheight, ypadding, lwd, ellipsis, debug) = style
 
 	y = yoffset + lineheight - textheight_function("X")/2
 
-	lbl = extract_labels(period, caption)
+	lbl = extract_labels(period, caption, index)
 	has_lbl = True in [i != '' for i in lbl]
-	[fnt_days, fnt_symbols, fnt_text] = extract_footnotes(period, caption)	
+	[fnt_days, fnt_symbols, fnt_text] = extract_footnotes(period, caption, index)	
 	has_fnt = True in fnt_days
 	if not footnotes:
 		has_fnt = False
 
-	svg_out = ""
-
 	if has_lbl or has_fnt:
 		if debug:
-			svg_out += render_dummy(period, xoffset, yoffset, lineheight, metrics)
+			render_dummy(out, period, xoffset, yoffset, lineheight, metrics)
 
-		centers = period_day_centers(period, xoffset, daywidth_function)
-		widths = daywidth_function(period)
+		centers = period_day_centers(period, xoffset, layout_function)
+		widths = layout_function(period).widths
 		for l, c, w, fd, fs in zip(lbl, centers, widths, fnt_days, fnt_symbols):
 			temp = str(l)
 			if fd and footnotes:
 				temp += f' ({fs})'
-			svg_out += svg_text(c-textwidth_function(temp)/2, y, temp)
-	return([svg_out, linheight+ypadding])
+			out.text(c-textwidth_function(temp)/2, y, temp)
+	return(linheight+ypadding)
 
 
 def make_footnote_text(footnote):
 	return(f'({footnote[0]})\t{footnote[1]}')
 
 
-def render_footnote_text(footnote, x, y, linehight, metrics, style):
-	(daywidth_function, textwidth_function, textheight_function) = metrics
+def render_footnote_text(out, footnote, x, y, linehight, metrics, style):
+	(layout_function, textwidth_function, textheight_function) = metrics
 	(periodspacing, lineheight, ypadding, lwd, ellipsis, debug) = style
 
-	svg_out = svg_text(x, y, make_footnote_text(footnote), css_class="footnote")
-	return([svg_out, textheight_function("XX")+ypadding])
+	out.text(x, y, make_footnote_text(footnote), css_class="footnote")
+	return(textheight_function("XX")+ypadding)
 
 
-def render_dose_graph(period, caption, xoffset, yoffset, lineheight, metrics, style, first_pass=True):
-	"""render dose over time for administration. Output is [svg_output, height]"""
-	(daywidth_function, textwidth_function, textheight_function) = metrics
+def render_dose_graph(out, period, caption, xoffset, yoffset, lineheight, metrics, style, first_pass=True, index=None):
+	"""render dose over time for administration. Output is the height"""
+	(layout_function, textwidth_function, textheight_function) = metrics
 	(periodspacing, lineheight, ypadding, lwd, ellipsis, debug) = style
 
-	svg_out = ""
 	if debug:
-		svg_out += render_dummy(period, xoffset, yoffset, lineheight+ textheight_function("X"), metrics)
+		render_dummy(out, period, xoffset, yoffset, lineheight+ textheight_function("X"), metrics)
 
-	startx = period_day_starts(period, xoffset, daywidth_function)
-	endx = period_day_ends(period, xoffset, daywidth_function)
-	doses = [i for i in extract_field(period, caption, "dose")]
+	startx = period_day_starts(period, xoffset, layout_function)
+	endx = period_day_ends(period, xoffset, layout_function)
+	doses = [i for i in extract_field(period, caption, "dose", index)]
 	doses_num = [i for i in doses if isinstance(i, int) or isinstance(i, float)]
 	if len(doses_num):
 		maxdose, mindose = max(doses_num), min(doses_num)
 
 		def dosey(dose):
+			if maxdose == mindose:
+				return(yoffset + lineheight*0.3)
 			return(yoffset + lineheight*0.6 - (dose-mindose)/(maxdose-mindose)*lineheight*0.6)
 
 		# if doses:
@@ -686,80 +1334,80 @@ def render_dose_graph(period, caption, xoffset, yoffset, lineheight, metrics, st
 		lastend = 0
 		for (s, e, d) in zip(startx, endx, doses):
 			if type(d)==int or type(d)==float:
-				svg_out += svg_line(s, dosey(d), e, dosey(d), lwd=lwd)
+				out.line(s, dosey(d), e, dosey(d), lwd=lwd)
 				if lasty:
-					svg_out += svg_line(lastx, lasty, s, dosey(d), lwd=lwd)
+					out.line(lastx, lasty, s, dosey(d), lwd=lwd)
 				lastx, lasty = e, dosey(d)
 				if d != lastdose:
 					if lastend + textwidth_function("n") < s:
-						svg_out += svg_text(s, yoffset + lineheight + textheight_function("X"), str(d))
+						out.text(s, yoffset + lineheight + textheight_function("X"), str(d))
 						lastend = s + textwidth_function(str(d))
 					lastdose = d
-	return([svg_out, lineheight+textheight_function("X")+ypadding])
+	return(lineheight+textheight_function("X")+ypadding)
 
 
-def render_interval(period, caption, xoffset, yoffset, lineheight, metrics, style, first_pass=True):
-	"""render interval for procedure. Output is [svg_output, height]"""
-	(daywidth_function, textwidth_function, textheight_function) = metrics
+def render_interval(out, period, caption, xoffset, yoffset, lineheight, metrics, style, first_pass=True, index=None):
+	"""render interval for procedure. Output is the height"""
+	(layout_function, textwidth_function, textheight_function) = metrics
 	(periodspacing, lineheight, ypadding, lwd, ellipsis, debug) = style
 
-	svg_out = ""
 	y = yoffset + lineheight/2
 	if debug:
-		svg_out += render_dummy(period, xoffset, yoffset, lineheight, metrics)
+		render_dummy(out, period, xoffset, yoffset, lineheight, metrics)
 
 	if first_pass:
-		svg_out += svg_text(5, y + textheight_function(caption) * (1/2 - 0.1), caption)
+		out.text(5, y + textheight_function(caption) * (1/2 - 0.1), caption)
 
 	# render interval box
-	starts = period_day_starts(period, xoffset, daywidth_function)
-	ends = period_day_ends(period, xoffset, daywidth_function)
-	widths = daywidth_function(period)
+	starts = period_day_starts(period, xoffset, layout_function)
+	ends = period_day_ends(period, xoffset, layout_function)
+	widths = layout_function(period).widths
 
 	height = 0.4 * lineheight
-	if 'intervals' in period.keys():
-		for intv in period['intervals']:
-			if intv['caption'] == caption:
-				if "start" in intv.keys() and "duration" in intv.keys():
-					start_list, duration_list = [intv['start']], [intv['duration']]
-				elif "days" in intv.keys() and isinstance(intv["days"], list):
-					start_list = decode_daylist(intv["days"])
-					duration_list = [1 for i in decode_daylist(intv["days"])]
-				else:
-					raise TypeError(f'{period["caption"]}, interval "{intv["caption"]}"')
+	if index is not None:
+		intervals = index.get((id(period), caption, 'intervals'), [])
+	else:
+		intervals = [i for i in period.get('intervals', []) if i['caption'] == caption]
+	for intv in intervals:
+		if "start" in intv.keys() and "duration" in intv.keys():
+			start_list, duration_list = [intv['start']], [intv['duration']]
+		elif "days" in intv.keys() and isinstance(intv["days"], list):
+			start_list = daylist_tuple(intv["days"])
+			duration_list = [1 for i in daylist_tuple(intv["days"])]
+		else:
+			raise TypeError(f'{period["caption"]}, interval "{intv["caption"]}"')
 
-				for start, duration in zip(start_list, duration_list):
-					startx = starts[day_index(period, start)]
-					end = start + duration -1
+		for start, duration in zip(start_list, duration_list):
+			startx = starts[day_index(period, start)]
+			end = start + duration -1
 
-					if start <0 and end >0:
-						end += 1
-					endx = ends[day_index(period, end)]
-					if "decoration" in intv.keys():
-						if intv["decoration"] == "bracketed":
-							wo = widths[day_index(period, start)]
-							wc = widths[day_index(period, end)]
-							svg_out += svg_open_bracket(startx, y, lineheight, wo*.6, xpadding=0, radius=lineheight/8, lwd=lwd)
-							svg_out += svg_close_bracket(endx, y, lineheight, wc*.6, xpadding=0, radius=lineheight/8, lwd=lwd)
-					svg_out += svg_rect(startx, y-height/2, endx-startx, height, lwd=lwd)
-	return([svg_out, lineheight+ypadding])
+			if start <0 and end >0:
+				end += 1
+			endx = ends[day_index(period, end)]
+			if "decoration" in intv.keys():
+				if intv["decoration"] == "bracketed":
+					wo = widths[day_index(period, start)]
+					wc = widths[day_index(period, end)]
+					out.open_bracket(startx, y, lineheight, wo*.6, xpadding=0, radius=lineheight/8, lwd=lwd)
+					out.close_bracket(endx, y, lineheight, wc*.6, xpadding=0, radius=lineheight/8, lwd=lwd)
+			out.rect(startx, y-height/2, endx-startx, height, lwd=lwd)
+	return(lineheight+ypadding)
 
 
 def timescale_height(lineheight, metrics, style):
-	(daywidth_function, textwidth_function, textheight_function) = metrics
+	(layout_function, textwidth_function, textheight_function) = metrics
 	(periodspacing, lineheight, ypadding, lwd, ellipsis, debug) = style
 	bracket_h = lineheight * 2/3
 	timescale_h = lineheight * 1.33 + ypadding * 2
 	return(bracket_h + ypadding * 1.5 + timescale_h + ypadding * 2)
 
 
-def render_times(period, caption, xoffset, yoffset, lineheight, metrics, style, maxwidth=100):
-	"""render timescale for procedure. Output is [svg_output, height]"""
-	(daywidth_function, textwidth_function, textheight_function) = metrics
+def render_times(out, period, caption, xoffset, yoffset, lineheight, metrics, style, maxwidth=100, index=None):
+	"""render timescale for procedure. Output is the height"""
+	(layout_function, textwidth_function, textheight_function) = metrics
 	(periodspacing, lineheight, ypadding, lwd, ellipsis, debug) = style
 
-	out = ""
-	proc = normalize_procedure(extract_procedure(period, caption))
+	proc = normalize_procedure(extract_procedure(period, caption, index))
 
 	ts_days = []
 	for x in ['procedures', 'administrations']:
@@ -783,23 +1431,23 @@ def render_times(period, caption, xoffset, yoffset, lineheight, metrics, style,
 	if ts_days:
 		## curly brackets
 		if debug:
-			out += render_dummy(period, xoffset, y, bracketheight, metrics)
+			render_dummy(out, period, xoffset, y, bracketheight, metrics)
 
 		for ts_d in ts_days:
 			times = unnormalize_procedure([i for i in proc if i[2]==ts_d])[0][1]
-			startx = period_day_starts(period, xoffset, daywidth_function)[day_index(period, min([i for (i, t, rel) in proc if rel==ts_d]))]
-			endx = period_day_ends(period, xoffset, daywidth_function)[day_index(period, max([i for (i, t, rel) in proc if rel==ts_d]))]
+			startx = period_day_starts(period, xoffset, layout_function)[day_index(period, min([i for (i, t, rel) in proc if rel==ts_d]))]
+			endx = period_day_ends(period, xoffset, layout_function)[day_index(period, max([i for (i, t, rel) in proc if rel==ts_d]))]
 			radius = bracketheight/2
 			if radius * 4 > endx-startx:
 				startx -= radius/2
 				endx += radius/2
 				radius = (endx-startx)/5
-			out += svg_curly_up(startx, endx, y, radius=radius, lwd=lwd)			
+			out.curly_up(startx, endx, y, radius=radius, lwd=lwd)
 		y += bracketheight + ypadding*1.5
 
 		## timescales
 		if debug:
-			out += render_dummy(period, xoffset, y, lineheight*1.33 + ypadding*2 + textheight_function("X"), metrics)
+			render_dummy(out, period, xoffset, y, lineheight*1.33 + ypadding*2 + textheight_function("X"), metrics)
 		for ts_d in ts_days:
 			times = unnormalize_procedure([i for i in proc if i[2]==ts_d])[0][1]
 
@@ -808,7 +1456,7 @@ def render_times(period, caption, xoffset, yoffset, lineheight, metrics, style,
 			times_below = len([i for i in times if i<=break_time])
 			times_above = len([i for i in times if i>break_time])
 
-			startx = period_day_starts(period, xoffset, daywidth_function)[day_index(period, min([i for (i, t, rel) in proc if rel==ts_d]))]
+			startx = period_day_starts(period, xoffset, layout_function)[day_index(period, min([i for (i, t, rel) in proc if rel==ts_d]))]
 
 			### scale
 			scale_height = lineheight/3
@@ -816,12 +1464,12 @@ def render_times(period, caption, xoffset, yoffset, lineheight, metrics, style,
 			scale_break = scale_width * times_below/(times_below+times_above)
 			scale_gap = textwidth_function("m")
 
-			scale_startx = max(min(startx, xoffset + period_width(period, daywidth_function) - scale_width), xoffset)
+			scale_startx = max(min(startx, xoffset + period_width(period, layout_function) - scale_width), xoffset)
 			if scale_startx < last_scale_end:
 				y += lineheight*1.33 + ypadding*3 + textheight_function("X")
 
 			def render_scale(x, y, width, height, scale_min, scale_max, scale_labels, show_unit=False):
-				out = svg_line(x, y, x+width, y, lwd=lwd)
+				out.line(x, y, x+width, y, lwd=lwd)
 				label_widths = [textwidth_function(str(i)) for i in scale_labels]
 				last_label_end = 0
 				final_label_begin = x + width - label_widths[-1]/2
@@ -829,81 +1477,90 @@ def render_times(period, caption, xoffset, yoffset, lineheight, metrics, style,
 
 				for i, wi in zip(scale_labels, label_widths):	
 					xi = (i-scale_min) * width/(scale_max-scale_min) + x
-					out += svg_line(xi, y-height/2, xi, y+height/2, lwd=lwd)
+					out.line(xi, y-height/2, xi, y+height/2, lwd=lwd)
 					dxi = wi/2
 					if xi-dxi > last_label_end and xi+dxi < final_label_begin - min_delta:
-						out += svg_text(xi-dxi, y+height/2+textheight_function("X")+ypadding, str(i))
+						out.text(xi-dxi, y+height/2+textheight_function("X")+ypadding, str(i))
 						last_label_end = xi+dxi+min_delta
 					if i == scale_labels[-1]:
 						temp = str(i)
 						if show_unit:
 							temp += " h"
-						out += svg_text(xi-dxi, y+height/2+textheight_function("X")+ypadding, temp)
-				return(out)
+						out.text(xi-dxi, y+height/2+textheight_function("X")+ypadding, temp)
 
 			def render_points(x, y, width, scale_min, scale_max):
 				points = [t for t in times if t>=scale_min and t<=scale_max]
 				points_x = [(i-scale_min) * width/(scale_max-scale_min) + x for i in points]
-				out = ""
 				for p, xi in zip(points, points_x):
-					out += svg_symbol(xi, y + lineheight/2, 0, "diamond", size=textheight_function("X"), lwd=lwd)
-				return(out)
+					out.symbol(xi, y + lineheight/2, 0, "diamond", size=textheight_function("X"), lwd=lwd)
 
-			out += render_points(scale_startx, y, scale_break, 0, break_time)
-			out += render_points(scale_startx+scale_break+scale_gap, y, scale_width - scale_gap - scale_break, 24, max(maxtime, 36))
+			render_points(scale_startx, y, scale_break, 0, break_time)
+			render_points(scale_startx+scale_break+scale_gap, y, scale_width - scale_gap - scale_break, 24, max(maxtime, 36))
 
-			out += render_scale(scale_startx, y+lineheight+ypadding, scale_break, scale_height, 0, break_time, range(0, int(break_time), 2))
+			render_scale(scale_startx, y+lineheight+ypadding, scale_break, scale_height, 0, break_time, range(0, int(break_time), 2))
 			if maxtime >=24:
-				out += render_scale(scale_startx+scale_break+scale_gap, y+lineheight+ypadding, scale_width - scale_gap - scale_break, scale_height, 24, max(maxtime, 36), [i*24 for i in range(1, int(maxtime/24+1))], show_unit=True)
+				render_scale(scale_startx+scale_break+scale_gap, y+lineheight+ypadding, scale_width - scale_gap - scale_break, scale_height, 24, max(maxtime, 36), [i*24 for i in range(1, int(maxtime/24+1))], show_unit=True)
 			last_scale_end = scale_startx + scale_width
 
-		return([out, y+lineheight*1.33 + ypadding*3 + textheight_function("X")-yoffset])
-
+		return(y+lineheight*1.33 + ypadding*3 + textheight_function("X")-yoffset)
 
-def add_output(old, new):
-	"""add output of render functions"""
-	return([o+n for o, n in zip(old, new)])
 
+def render_periods(out, periods, x, y, caption, height, render_function, metrics, style, dashes=False, footnotes=False, index=None, shapes=None, **kwargs):
+	"""applies rendering function to all periods. Output is the height
 
-def render_periods(periods, x, y, caption, height, render_function, metrics, style, dashes=False, footnotes=False, **kwargs):
-	"""applies rendering function to all periods"""
-	daywidth_function= metrics[0]
+	:param shapes:	shape per period (see PreparedDesign), the output of a period is rendered once per shape and copied for the later periods of the same shape. No copies if None
+	"""
+	layout_function = metrics[0]
 	(periodspacing, lineheight, ypadding, lwd, ellipsis, debug) = style
-
-	w = [period_width(i, daywidth_function) for i in periods]
+	if shapes is None:
+		shapes = [None] * len(periods)
+	fragments = {}
+
+	def render_copy(key, x, render):
+		"""render, or place the fragment rendered for the same key before"""
+		if key in fragments:
+			(fragment, x0, value) = fragments[key]
+			out.place(fragment, x - x0)
+			return(value)
+		position = out.position()
+		value = render()
+		if key[1] is not None:
+			fragments[key] = (out.since(position), x, value)
+		return(value)
 	first = True
 	last = False
 	h = 0
-	out = ""
 
 	# render labels, if applicable
-	has_labels = len([i for ii in [extract_labels(p, caption) for p in periods] for i in ii if i != '']) != 0
-	has_footnotes = True in [i for ii in [extract_footnotes(p, caption)[0] for p in periods] for i in ii]
+	has_labels = len([i for ii in [extract_labels(p, caption, index) for p in periods] for i in ii if i != '']) != 0
+	has_footnotes = True in [i for ii in [extract_footnotes(p, caption, index)[0] for p in periods] for i in ii]
 	if not footnotes:
 		has_footnotes = False
 
 	if has_labels or has_footnotes:
 		xx = x
-		for p in periods:
-			[svg_out, y_out] = render_labels_footnotes(p, caption, xx, y, height, metrics, style, footnotes=footnotes)
-			out += svg_out
-			xx += period_width(p, daywidth_function) + periodspacing
+		for p, shape in zip(periods, shapes):
+			render_copy(("labels", shape), xx, lambda: render_labels_footnotes(out, p, caption, xx, y, height, metrics, style, footnotes=footnotes, index=index))
+			xx += period_width(p, layout_function) + periodspacing
 		h += lineheight
 		y += h
 
 	# render procedure
-	for p in periods:
+	for p, shape in zip(periods, shapes):
 		if p==periods[-1]:
 			last=True
 
-		[svg_out, y_out] = render_function(p, caption, x, y, height, metrics, style, first_pass=first, **kwargs)
-		out += svg_out
+		if first:
+			# the first period also renders the caption and is never copied
+			y_out = render_function(out, p, caption, x, y, height, metrics, style, first_pass=first, index=index, **kwargs)
+		else:
+			y_out = render_copy(("row", shape), x, lambda: render_function(out, p, caption, x, y, height, metrics, style, first_pass=first, index=index, **kwargs))
 
 		if dashes and not last:
-			out += svg_line(x+period_width(p, daywidth_function), y+height/2, x+period_width(p, daywidth_function)+periodspacing, y+height/2, lwd=lwd)
-		x += period_width(p, daywidth_function) + periodspacing
+			out.line(x+period_width(p, layout_function), y+height/2, x+period_width(p, layout_function)+periodspacing, y+height/2, lwd=lwd, layer="grid")
+		x += period_width(p, layout_function) + periodspacing
 		first=False
-	return(add_output(["", h], [out, y_out]))
+	return(h + y_out)
 
 
 def make_dayrange(start, duration):
@@ -916,58 +1573,111 @@ def make_dayrange(start, duration):
 	return(out)
 
 
+def shift_day(day, offset):
+	"""shift day by offset days, skipping the absent day 0"""
+	temp = (day if day > 0 else day + 1) + offset
+	return(temp if temp > 0 else temp - 1)
+
+
+def shift_item(item, offset):
+	"""return copy of interval, administration or procedure with all days shifted by offset"""
+	out = dict(item)
+	if "days" in out:
+		out["days"] = [shift_day(d, offset) for d in daylist_tuple(out["days"])]
+	for field in ("start", "relative"):
+		if field in out:
+			out[field] = shift_day(out[field], offset)
+	if "footnotes" in out:
+		out["footnotes"] = [dict(f, days=[shift_day(d, offset) for d in daylist_tuple(f["days"])]) if "days" in f else f for f in out["footnotes"]]
+	return(out)
+
+
+def expand_repeat(period):
+	"""generate the copies of a repeated period
+
+	The "repeat" field of the period is the number of copies or a dictionary with the fields "count" and, optionally, "offset". "{n}" in the caption is replaced by the number of the copy, starting with 1, otherwise the number is appended to the caption. With offset, each copy starts offset days after the previous one, and all days of the period are shifted accordingly. Copies without offset share the intervals, administrations and procedures of the template.
+	"""
+	repeat = period["repeat"]
+	(count, offset) = (repeat.get("count"), repeat.get("offset", 0)) if isinstance(repeat, dict) else (repeat, 0)
+	if type(count) != int or count < 1 or type(offset) != int:
+		raise ValueError(f'invalid repeat {repeat} in period {period.get("caption", "")}, expected a positive count and an integer offset')
+	template = {k: v for k, v in period.items() if k != "repeat"}
+	caption = str(template.get("caption", ""))
+	for i in range(count):
+		out = dict(template)
+		out["caption"] = caption.replace("{n}", str(i + 1)) if "{n}" in caption else f'{caption} {i + 1}'
+		if offset and i:
+			shift = offset * i
+			out["start"] = shift_day(out.get("start", 1), shift)  # cycles start on day 1 by default
+			for field in ("daylabels", "dayshading"):
+				if field in out:
+					out[field] = [shift_day(d, shift) for d in daylist_tuple(out[field])]
+			for field in ("intervals", "administrations", "procedures"):
+				if field in out:
+					out[field] = [shift_item(item, shift) for item in out[field]]
+		yield out
+
+
+def period_tree(x, period_class="periods"):
+	"""flatten the period_class items and collect the period groups in one traversal
+
+	Items with "periods" are period groups, their period_class items are included recursively. Items with "repeat" are expanded to their copies (see expand_repeat). The result is built anew for each call and is immutable.
+
+	:rtype:		tuple
+	:return:	(periods, groups), with the periods in order, and the groups as (index of first period, index of last period, caption), outer groups before inner groups and later groups before earlier ones
+	"""
+	periods = []
+	groups = []
+	# explicit stack of (items, position, start index, caption) instead of recursion
+	stack = [(x[period_class], 0, 0, "")]
+	while stack:
+		(items, i, start, caption) = stack.pop()
+		if i < len(items):
+			stack.append((items, i + 1, start, caption))
+			item = items[i]
+			if "periods" in item:
+				stack.append((item[period_class], 0, len(periods), item["caption"]))
+			elif "repeat" in item:
+				periods.extend(expand_repeat(item))
+			else:
+				periods.append(item)
+		elif len(stack) and caption != "":
+			groups.append((start, len(periods) - 1, caption))
+	return((tuple(periods), tuple(reversed(groups))))
+
+
 def flatten_periods(x, period_class):
 	"""flatten list of period_class items"""
-	out = []
-	for i in x[period_class]:
-		if "periods" in i:
-			out += flatten_periods(i, period_class)
-		else:
-			out += [i]
-	return(out)
+	return(list(period_tree(x, period_class)[0]))
 
 
-def vertical_marker(x):
-	out = ""
-	if isinstance(x, list):
-		for i in x:
-			out += svg_line(i, 20, i, 2000, color="red")
-			out += svg_text(i, 20, str(int(i)), color="red")
-	else:
-		out += svg_line(x, 20, x, 2000, color="red")
-		out += svg_text(x, 20, str(int(x)), color="red")
-	return(out)
+def vertical_marker(out, x):
+	if not isinstance(x, list):
+		x = [x]
+	for i in x:
+		out.line(i, 20, i, 2000, color="red")
+		out.text(i, 20, str(int(i)), color="red")
 
 
 def get_period_nesting(x):
-	def _nesting(x, out=[], index=0, caption=""):
-		start_i = index
-		for p in x["periods"]:
-			if "periods" in p.keys():
-				temp = _nesting(p, out=out, index=index, caption=p["caption"])
-				index = temp[0]
-				out = temp[1]
-			else:
-				index += 1
-		out.append(list((start_i, index-1, caption)))
-		return([index, out])
+	"""return the period groups of a trial design, see period_tree"""
+	if "periods" not in x.keys():
+		return(())
+	return(period_tree(x, "periods")[1])
 
-	temp = [i for i in _nesting(x)[1] if i[2] != ""]
-	return(list(reversed(temp)))
 
+def render_period_grouping(out, nesting, periods, xoffset, yoffset, metrics, style):
+	"""render the captions and brackets of period groups
 
-def render_period_grouping(td, xoffset, yoffset, metrics, style):
-	(daywidth_function, textwidth_function, textheight_function) = metrics
+	:param nesting:	period groups, see get_period_nesting
+	:param periods:	the flattened periods, as used for the layout
+	"""
+	(layout_function, textwidth_function, textheight_function) = metrics
 	(periodspacing, lineheight, ypadding, lwd, ellipsis, debug) = style
 
-	svg_out = ""
-	nesting = get_period_nesting(td)
-	for period_class in ["periods", "cycles"]:
-		if period_class in td.keys():
-			periods = flatten_periods(td, period_class)
 
 	# make metrics
-	w = [period_width(i, daywidth_function) for i in periods]
+	w = [period_width(i, layout_function) for i in periods]
 	starts = [xoffset]
 	ends = []
 
@@ -982,62 +1692,160 @@ def render_period_grouping(td, xoffset, yoffset, metrics, style):
 		e = ends[n[1]]
 
 		if debug:
-			svg_out += svg_rect(s, yoffset + y, e-s, textheight_function("X") + ypadding + lineheight/2, lwd=0, fill_color="cornsilk")
-		svg_out += svg_text(s+(e-s)/2-textwidth_function(str(n[2]))/2, yoffset + y+textheight_function("X"), str(n[2]))
+			out.rect(s, yoffset + y, e-s, textheight_function("X") + ypadding + lineheight/2, lwd=0, fill_color="cornsilk", layer="background")
+		out.text(s+(e-s)/2-textwidth_function(str(n[2]))/2, yoffset + y+textheight_function("X"), str(n[2]))
 		y += textheight_function("X") + ypadding
-		svg_out += svg_bracket_down(s, e, yoffset + y, lineheight/2, lwd=lwd)
-		y += lineheight/2	
-	return([svg_out, y])
+		out.bracket_down(s, e, yoffset + y, lineheight/2, lwd=lwd, layer="grid")
+		y += lineheight/2
+	return(y)
 
 
-def render_td(td, title="", debug=False, fontsize=14, font="Arial", condensed=False, autocompress=False, timescale=False, padding=1, ellipsis=False, footnotes=False, graph=False):
-	# VALIDATE INPUT
-	# parse periods
-	periods = []
-	try:
-		for period_class in ["periods", "cycles"]:
-			if period_class in td.keys():
-				pds = flatten_periods(td, period_class) # flatten if nested
-				for p in pds:
-					if period_class == "cycles" and not "start" in p.keys():
-						p["start"] = 1
-					assert_period_format(p)
-					periods.append(p)
-					if not "daylabels" in p.keys():
-						p["daylabels"] = make_dayrange(p["start"], p["duration"])
-
-		if not len(periods):
-			raise KeyError("no period or cycle found in trial design")
-	except Exception as err:
-		raise RuntimeError(f'error parsing periods: {err}')
+# PROFILING
 
-	## assert procedure format
-	for p in periods:
-		for (n, assert_func) in [("intervals", assert_interval_format), ("administrations", assert_procedure_format), ("procedures", assert_procedure_format)]:
-			if n in p.keys():
-				for i in p[n]:
-					assert_func(i)
+def phase_timer(profile):
+	"""return function that adds the wall time since its previous call, and one call, to the profile entry for a phase
+
+	Profile entries are dictionaries with "time" (in seconds) and "calls" fields, keyed by phase name. The timer does nothing if profile is None.
+	"""
+	last = [time.perf_counter()]
+
+	def mark(name):
+		if profile is not None:
+			now = time.perf_counter()
+			entry = profile.setdefault(name, {"time": 0, "calls": 0})
+			entry["time"] += now - last[0]
+			entry["calls"] += 1
+			last[0] = now
+	return(mark)
+
+
+def format_profile(profile):
+	"""format profile as text table with time in milliseconds and share of the total time per phase"""
+	total = sum([i["time"] for i in profile.values()])
+	width = max([len(i) for i in profile] + [5])
+	lines = [f'{"phase":<{width}}{"calls":>8}{"time [ms]":>12}{"share":>8}']
+	for name, entry in profile.items():
+		share = entry["time"] / total if total else 0
+		lines.append(f'{name:<{width}}{entry["calls"]:>8}{entry["time"] * 1000:>12.1f}{share:>8.1%}')
+	lines.append(f'{"total":<{width}}{"":>8}{total * 1000:>12.1f}')
+	return("\n".join(lines))
+
+
+def period_shapes(periods):
+	"""return shape number per period, periods with the same content except for the caption have the same shape"""
+	shapes = {}
+	out = []
+	for i, p in enumerate(periods):
+		try:
+			key = json.dumps({k: v for k, v in p.items() if k != "caption"}, sort_keys=True, default=str)
+		except TypeError:
+			key = i  # not comparable, e.g., mixed key types
+		out.append(shapes.setdefault(key, len(shapes)))
+	return(out)
 
-	# MAKE METRICS
-	ypadding = fontsize/1.8 * padding
-	canvas = cairo.Context(cairo.SVGSurface("temp.svg", 10, 10))
-	canvas.select_font_face(font, cairo.FONT_SLANT_NORMAL, cairo.FONT_WEIGHT_NORMAL)
-	canvas.set_font_size(fontsize)
 
-	def make_textwidth(canvas):
-		def textwidth_function(text):
-			(x, y, cap_width, cap_height, dx, dy) = canvas.text_extents(text)
-			return(cap_width)
-		return textwidth_function
+class PreparedDesign:
+	"""trial design validated and flattened for rendering
 
-	def make_textheight(canvas):
-		def textheight_function(text):
-			(x, y, cap_width, cap_height, dx, dy) = canvas.text_extents(text)
-			return(cap_height)
-		return textheight_function
+	Everything that does not depend on the rendering options is extracted once and shared by all renders of the design (see render_prepared): the flattened periods and the period groups, the period shapes, the item index and names, and, on first use, the footnote list and the period layouts per font and day grid mode. The periods are copies, i.e., the input is not changed.
+
+	Periods that are identical except for their caption, like treatment cycles repeated without offset, have the same shape. Periods with other day numbers, e.g., repeated with an offset, have different day labels and shapes. Their rows are rendered once and copied (see render_periods).
+	"""
+	__slots__ = ("td", "periods", "grouped", "index", "items", "nesting", "shapes", "footnotes", "layouts")
+
+	def __init__(self, td):
+		# VALIDATE INPUT
+		# parse periods, the periods are copied so that the defaults added here do not change the input
+		periods = []
+		pds = []
+		nesting = ()
+		try:
+			for period_class in ["periods", "cycles"]:
+				if period_class in td.keys():
+					(flat, groups) = period_tree(td, period_class) # flatten if nested
+					if period_class == "periods":
+						nesting = groups
+					pds = [dict(p) for p in flat]
+					for p in pds:
+						if period_class == "cycles" and not "start" in p.keys():
+							p["start"] = 1
+						assert_period_format(p)
+						periods.append(p)
+						if not "daylabels" in p.keys():
+							p["daylabels"] = make_dayrange(p["start"], p["duration"])
+
+			if not len(periods):
+				raise KeyError("no period or cycle found in trial design")
+		except Exception as err:
+			raise RuntimeError(f'error parsing periods: {err}')
+
+		## assert procedure format, once for the items shared by repeated periods
+		checked = set()
+		for p in periods:
+			for (n, assert_func) in [("intervals", assert_interval_format), ("administrations", assert_procedure_format), ("procedures", assert_procedure_format)]:
+				if n in p.keys() and id(p[n]) not in checked:
+					checked.add(id(p[n]))
+					for i in p[n]:
+						assert_func(i)
+
+		self.td = td
+		self.periods = periods
+		self.grouped = pds  # the periods of the last period class, for the period grouping
+		try:
+			self.index = index_items(periods)
+		except Exception as err:
+			raise RuntimeError(f'error parsing procedures: {err}')
+		self.items = item_names(periods, 'procedures') + item_names(periods, 'intervals') + item_names(periods, 'administrations')
+		self.nesting = nesting
+		self.shapes = period_shapes(periods)
+		self.footnotes = None
+		self.layouts = {}
 
-	textheight_function = make_textheight(canvas)
-	textwidth_function = make_textwidth(canvas)
+
+def prepare_design(td, profile=None):
+	"""validate and prepare trial design for rendering, see PreparedDesign
+
+	If profile is a dictionary, the time is added to its validation phase.
+	"""
+	mark = phase_timer(profile)
+	prepared = PreparedDesign(td)
+	mark("validation")
+	return(prepared)
+
+
+def render_td(td, title="", debug=False, fontsize=14, font="Arial", condensed=False, autocompress=False, timescale=False, padding=1, ellipsis=False, footnotes=False, graph=False, text_metrics="cairo", glyph_table="", output_format="svg", compact=False, scale=1, stream=None, profile=None):
+	"""render trial design as svg
+
+	The trial design is not changed. The svg document is returned as string or, if stream is given, written to the stream (a text file object). If compact, the svg document is written in compact form (see CompactSvgWriter), and output_format "svgz" returns it gzip-compressed as bytes. With output_format "pdf", "png" or "cairo-svg", the figure is drawn with cairo instead (see CairoWriter), returned as bytes or written to a binary stream, and scale sets the size of png pixels in points. If profile is a dictionary, the wall time and number of calls of the rendering phases are added to it (see phase_timer). The phases are validation, metrics, layout, the row types (grouping, header, intervals, administrations, dose graphs, procedures, timescales), decorations, footnotes and output.
+	"""
+	return(render_prepared(prepare_design(td, profile), title=title, debug=debug, fontsize=fontsize, font=font, condensed=condensed, autocompress=autocompress, timescale=timescale, padding=padding, ellipsis=ellipsis, footnotes=footnotes, graph=graph, text_metrics=text_metrics, glyph_table=glyph_table, output_format=output_format, compact=compact, scale=scale, stream=stream, profile=profile))
+
+
+def render_variants(td, variants, **kwargs):
+	"""render trial design in several variants, validating and preparing it only once
+
+	:param variants:	rendering options per variant, as list of dictionaries that override the keyword arguments
+	:rtype:				list
+	:return:			svg documents, in the order of the variants
+	"""
+	prepared = prepare_design(td, kwargs.get("profile"))
+	return([render_prepared(prepared, **{**kwargs, **v}) for v in variants])
+
+
+def render_prepared(prepared, title="", debug=False, fontsize=14, font="Arial", condensed=False, autocompress=False, timescale=False, padding=1, ellipsis=False, footnotes=False, graph=False, text_metrics="cairo", glyph_table="", output_format="svg", compact=False, scale=1, stream=None, profile=None):
+	"""render prepared trial design as svg, see render_td and prepare_design"""
+	mark = phase_timer(profile)
+	td = prepared.td
+	periods = prepared.periods
+	items_index = prepared.index
+
+
+	# MAKE METRICS
+	ypadding = fontsize/1.8 * padding
+	if callable(text_metrics):
+		(textwidth_function, textheight_function) = make_text_functions(text_metrics)
+	else:
+		(textwidth_function, textheight_function) = font_metrics(font, fontsize, text_metrics, glyph_table)
 
 	def make_daywidth_function(textwidth_function, condensed):
 		if condensed:
@@ -1054,8 +1862,13 @@ def render_td(td, title="", debug=False, fontsize=14, font="Arial", condensed=Fa
 				return([textwidth_function("XX")] * period['duration'])
 		return(daywidth_function)
 
-	daywidth_function = make_daywidth_function(textwidth_function, condensed)
-	metrics = (daywidth_function, textwidth_function, textheight_function)
+	# periods are laid out once per font and day grid mode
+	mode = "condensed" if condensed else "autocompress" if autocompress else "grid"
+	layout_key = (font, fontsize, text_metrics, glyph_table, mode)
+	if layout_key not in prepared.layouts:
+		prepared.layouts[layout_key] = make_layout_function(make_daywidth_function(textwidth_function, condensed))
+	layout_function = prepared.layouts[layout_key]
+	metrics = (layout_function, textwidth_function, textheight_function)
 
 	# MAKE STYLE
 	periodspacing = textwidth_function("XX")
@@ -1064,42 +1877,58 @@ def render_td(td, title="", debug=False, fontsize=14, font="Arial", condensed=Fa
 	try:
 		xoffset = 30
 		yoffset = 10
-		items = item_names(periods, 'procedures') + item_names(periods, 'intervals') + item_names(periods, 'administrations')
-		if items:
-			xoffset += max([textwidth_function(i) for i in items])
+		if prepared.items:
+			xoffset += max([textwidth_function(i) for i in prepared.items])
 		lwd = fontsize/10
 		style = (periodspacing, lineheight, ypadding, lwd, ellipsis, debug)
 	except Exception as err:
 		raise RuntimeError(f'error making style: {err}')
+	mark("metrics")
 
-	# RENDER SVG OUTPUT
-	out = ["", yoffset]
+	# MAKE LAYOUT
+	for p in periods:
+		layout_function(p)
+	mark("layout")
+
+	# RENDER OUTPUT
+	if output_format == "svg":
+		out = CompactSvgWriter() if compact else SvgWriter()
+	elif output_format == "svgz":
+		out = CompactSvgWriter(gzipped=True)
+	else:
+		out = CairoWriter(output_format.replace("cairo-", ""), scale)
+	y = yoffset
 
 	# render period grouping
-	out = add_output(out, render_period_grouping(td, xoffset, out[1], metrics, style))
-	yheader = out[1]
+	y += render_period_grouping(out, prepared.nesting, prepared.grouped, xoffset, y, metrics, style)
+	yheader = y
+	mark("grouping")
 
 	# render header
-	out = add_output(out, render_periods(periods, xoffset, out[1], "", lineheight, render_periodcaption, metrics, style))
+	y += render_periods(out, periods, xoffset, y, "", lineheight, render_periodcaption, metrics, style, index=items_index)
 	try:
-		out = add_output(out, render_periods(periods, xoffset, out[1], "", lineheight, render_daygrid, metrics, style, dashes=True))
+		y += render_periods(out, periods, xoffset, y, "", lineheight, render_daygrid, metrics, style, dashes=True, index=items_index, shapes=prepared.shapes)
 	except Exception as err:
 		raise  RuntimeError(f'error rendering period headers: {err}')
+	mark("header")
 
 	# render intervals
 	for n in item_names(periods, 'intervals'):
 		try:
-			out = add_output(out, render_periods(periods, xoffset, out[1], n, lineheight, render_interval, metrics, style, footnotes=footnotes))
+			y += render_periods(out, periods, xoffset, y, n, lineheight, render_interval, metrics, style, footnotes=footnotes, index=items_index, shapes=prepared.shapes)
+			mark("intervals")
 		except Exception as err:
 			raise RuntimeError(f'error rendering intervals: {err}')
 
 	# render administrations
 	for n in item_names(periods, 'administrations'):
 		try:	
-			out = add_output(out, render_periods(periods, xoffset, out[1], n, lineheight, render_procedure, metrics, style, default_symbol="arrow", footnotes=footnotes))
+			y += render_periods(out, periods, xoffset, y, n, lineheight, render_procedure, metrics, style, default_symbol="arrow", footnotes=footnotes, index=items_index, shapes=prepared.shapes)
+			mark("administrations")
 			if graph:
-				if [i for p in periods for i in extract_field(p, n, "dose") if i != ""]:
-					out = add_output(out, render_periods(periods, xoffset, out[1], n, lineheight, render_dose_graph, metrics, style))
+				if [i for p in periods for i in extract_field(p, n, "dose", items_index) if i != ""]:
+					y += render_periods(out, periods, xoffset, y, n, lineheight, render_dose_graph, metrics, style, index=items_index, shapes=prepared.shapes)
+				mark("dose graphs")
 		except Exception as err:
 			raise RuntimeError(f'error rendering administrations: {err}')
 
@@ -1107,28 +1936,29 @@ def render_td(td, title="", debug=False, fontsize=14, font="Arial", condensed=Fa
 	last_proc_has_timescale = False
 	for n in item_names(periods, 'procedures'):
 		try:
-			out = add_output(out, render_periods(periods, xoffset, out[1], n, lineheight, render_procedure, metrics, style, default_symbol="diamond", footnotes=footnotes))
+			y += render_periods(out, periods, xoffset, y, n, lineheight, render_procedure, metrics, style, default_symbol="diamond", footnotes=footnotes, index=items_index, shapes=prepared.shapes)
+			mark("procedures")
 			if timescale:
 				ts = False
 				x = xoffset
 				for p in periods:
-					if has_timescale(p, n):
+					if has_timescale(p, n, items_index):
 						ts = True
 						break
-					x += period_width(p, daywidth_function)
+					x += period_width(p, layout_function)
 					x += periodspacing
 				if ts:
 					if n == item_names(periods, 'procedures')[-1]:
 						last_proc_has_timescale = True
-					out = add_output(out, render_times(p, n, x, out[1], lineheight, metrics, style, maxwidth=xoffset + sum([period_width(i, daywidth_function) for i in periods]) + (len(periods)-1) * periodspacing - textwidth_function(" h")))
+					y += render_times(out, p, n, x, y, lineheight, metrics, style, maxwidth=xoffset + sum([period_width(i, layout_function) for i in periods]) + (len(periods)-1) * periodspacing - textwidth_function(" h"), index=items_index)
+				mark("timescales")
 		except Exception as err:
 			raise RuntimeError(f'error rendering procedures: {err}')
 
 	# apply period decorations
 	try:
 		x = xoffset
-		# height = out[1] - yoffset - ypadding/2
-		height = out[1] - yheader - ypadding/2
+		height = y - yheader - ypadding/2
 		if last_proc_has_timescale:
 			height -= timescale_height(lineheight, metrics, style)
 
@@ -1139,37 +1969,440 @@ def render_td(td, title="", debug=False, fontsize=14, font="Arial", condensed=Fa
 
 			for p, bracketed, b_leading, b_trailing, highlighted in zip(periods, bracketing, leading_edge(bracketing), trailing_edge(bracketing), highlighting):
 				if highlighted:
-					out[0] = svg_rect(x-periodspacing/4, yheader, period_width(p, daywidth_function)+periodspacing/2, height, lwd=0, fill_color="#eee") + out[0]
+					out.rect(x-periodspacing/4, yheader, period_width(p, layout_function)+periodspacing/2, height, lwd=0, fill_color="#eee", layer="underlay")
 				if bracketed:
 					if b_leading:
-						out[0] = svg_open_bracket(x-periodspacing/4, yheader+height/2, height, lineheight/4, xpadding=0, radius=lineheight/4, lwd=lwd) + out[0]
+						out.open_bracket(x-periodspacing/4, yheader+height/2, height, lineheight/4, xpadding=0, radius=lineheight/4, lwd=lwd, layer="underlay")
 					if b_trailing:
-						out[0] = svg_close_bracket(x+period_width(p, daywidth_function)+periodspacing/4, yheader+height/2, height, lineheight/4, xpadding=0, radius=lineheight/4, lwd=lwd) + out[0]
+						out.close_bracket(x+period_width(p, layout_function)+periodspacing/4, yheader+height/2, height, lineheight/4, xpadding=0, radius=lineheight/4, lwd=lwd, layer="underlay")
 
-				x += period_width(p, daywidth_function) + periodspacing
+				x += period_width(p, layout_function) + periodspacing
 	except Exception as err:
 		raise RuntimeError(f'error rendering period decorations: {err}')
+	mark("decorations")
 
 	# make footnote list
 	try:
 		max_footnote_width = 0
-		fn = footnote_list(periods)
+		if prepared.footnotes is None:
+			prepared.footnotes = footnote_list(periods, items_index)
+		fn = prepared.footnotes
 		if footnotes and fn:
-			out[1] += ypadding * 4
+			y += ypadding * 4
 			for ff in fn:
-				out = add_output(out, render_footnote_text(ff, xoffset, out[1], lineheight, metrics, style))
+				y += render_footnote_text(out, ff, xoffset, y, lineheight, metrics, style)
 			max_footnote_width = max([textwidth_function(make_footnote_text(ff)) for ff in fn])
 	except Exception as err:
 		raise RuntimeError(f'error rendering footnote list: {err}')
+	mark("footnotes")
 
 	# re-calculate overall output dimensions, finalize svg
-	viewport_width = max(xoffset + sum([period_width(i, daywidth_function) for i in periods]) + (len(periods)) * periodspacing, xoffset + max_footnote_width)
-	viewport_height = out[1]
+	viewport_width = max(xoffset + sum([period_width(i, layout_function) for i in periods]) + (len(periods)) * periodspacing, xoffset + max_footnote_width)
+	viewport_height = y
 
-	svg_out = f'<svg width="{viewport_width}" height="{viewport_height}" xmlns="http://www.w3.org/2000/svg">\n<style>text {{font-family: {font}; font-size: {fontsize}px ;}}</style>\n<desc>Trial design autogenerated by td.py version {__version__} ({__date__}), author: Rainer Strotmann</desc><title>{title}</title>' + out[0]
-	
-	svg_out += f'</svg>'
-	return(svg_out)
+	document = out.document(viewport_width, viewport_height, title, font, fontsize, stream)
+	mark("output")
+	return(document)
+
+
+def design_dict(design):
+	"""return trial design as dictionary
+
+	The design can be a mapping (e.g., the parsed json or yaml input), a dataclass, or a model object with model_dump() or dict() method, like pydantic models.
+	"""
+	if isinstance(design, dict):
+		return(design)
+	import collections.abc
+	import dataclasses
+	if isinstance(design, collections.abc.Mapping):
+		return(dict(design))
+	if dataclasses.is_dataclass(design) and not isinstance(design, type):
+		return(dataclasses.asdict(design))
+	for method in ("model_dump", "dict"):
+		if callable(getattr(design, method, None)):
+			return(getattr(design, method)())
+	raise TypeError(f'cannot render trial design of type {type(design).__name__}')
+
+
+def render(design, stream=None, encoding=None, **kwargs):
+	"""render trial design to svg without changing it. Keyword arguments are passed on to render_td
+
+	The svg document is returned as string, as bytes if encoding is given (e.g., "utf-8"), or written to stream, which can be a text or binary file object (binary streams are written in the encoding, default utf-8). Other output formats (see render_td) are returned as bytes or written to a binary stream.
+
+	:param design:	trial design, see design_dict
+	"""
+	import io
+	td = design_dict(design)
+	if kwargs.get("output_format", "svg") != "svg":
+		return(render_td(td, stream=stream, **kwargs))
+	if stream is None:
+		svg_out = render_td(td, **kwargs)
+		return(svg_out.encode(encoding) if encoding else svg_out)
+	if isinstance(stream, (io.RawIOBase, io.BufferedIOBase)):
+		text_stream = io.TextIOWrapper(stream, encoding=encoding or "utf-8", write_through=True)
+		try:
+			render_td(td, stream=text_stream, **kwargs)
+		finally:
+			text_stream.detach()
+		return
+	render_td(td, stream=stream, **kwargs)
+
+
+########################################
+
+# FILE HANDLING
+
+DESIGN_SUFFIXES = (".json", ".yaml", ".yml")
+STDIN = "-"
+
+
+def design_name(infile):
+	"""return the name of a design file, used as title and output file name"""
+	return("stdin" if str(infile) == STDIN else infile.stem)
+
+
+def expand_inputs(inputs):
+	"""expand input arguments to a list of design files
+
+	Each input can be a file, a glob pattern or a directory. Directories are searched for json and yaml files (not recursively).
+	"""
+	out = []
+	for i in inputs:
+		path = pathlib.Path(i)
+		if path.is_dir():
+			out += sorted(f for f in path.iterdir() if f.suffix.lower() in DESIGN_SUFFIXES)
+		elif glob.has_magic(i):
+			out += [pathlib.Path(f) for f in sorted(glob.glob(i, recursive=True))]
+		else:
+			out.append(path)
+	return(list(dict.fromkeys(out)))
+
+
+def is_batch(inputs):
+	"""test if the input arguments are rendered in batch mode, i.e., more than one argument, a directory or a glob pattern"""
+	return(len(inputs) > 1 or any(glob.has_magic(i) or pathlib.Path(i).is_dir() for i in inputs))
+
+
+def output_file(infile, output="", batch=False, suffix=".svg"):
+	"""return the output file for an input file
+
+	Output goes to the output file, or into the output directory, if output is a directory or in batch mode (see is_batch). Without output, the svg file is written next to the input file, or to the standard output for designs read from the standard input.
+	"""
+	if output:
+		if output == STDIN:
+			return(pathlib.Path(STDIN))
+		temp = pathlib.Path.cwd().joinpath(output)
+		if batch:
+			temp.mkdir(parents=True, exist_ok=True)
+		if temp.is_dir():
+			return(temp.joinpath(design_name(infile) + suffix))
+		return(temp)
+	if str(infile) == STDIN:
+		return(pathlib.Path(STDIN))
+	return(infile.resolve().parent.joinpath(infile.stem + suffix))
+
+
+def output_files(infiles, output="", batch=False, suffix=".svg"):
+	"""return (infile, outfile) pairs for the input files, see output_file
+
+	Input files with the same name keep their path relative to the common directory of the input files in the output directory. Raises ValueError if input files would still overwrite each other's output, e.g., study.json and study.yaml in the same directory.
+	"""
+	out = [(infile, output_file(infile, output, batch, suffix)) for infile in infiles]
+	counts = {}
+	for (infile, outfile) in out:
+		counts[outfile] = counts.get(outfile, 0) + 1
+	if output and output != STDIN and max(counts.values(), default=0) > 1:
+		common = pathlib.Path(os.path.commonpath([infile.resolve().parent for infile in infiles if str(infile) != STDIN]))
+		for i, (infile, outfile) in enumerate(out):
+			if counts[outfile] > 1 and str(infile) != STDIN:
+				temp = outfile.parent.joinpath(infile.resolve().parent.relative_to(common), outfile.name)
+				temp.parent.mkdir(parents=True, exist_ok=True)
+				out[i] = (infile, temp)
+	duplicates = {}
+	for (infile, outfile) in out:
+		if str(outfile) != STDIN:
+			duplicates.setdefault(outfile, []).append(infile)
+	for outfile, inputs in duplicates.items():
+		if len(inputs) > 1:
+			raise ValueError(f'{" and ".join(str(i) for i in inputs)} would both be written to {outfile}')
+	return(out)
+
+
+@functools.lru_cache(maxsize=None)
+def json_parser():
+	"""return the function that parses json text, orjson if installed"""
+	try:
+		import orjson
+	except ImportError:
+		return(json.loads)
+	return(orjson.loads)
+
+
+@functools.lru_cache(maxsize=None)
+def yaml_parser():
+	"""return the function that parses yaml text, with the libyaml based loader if available"""
+	import yaml
+	loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+	return(lambda text: yaml.load(text, Loader=loader))
+
+
+def parse_design(text, suffix=""):
+	"""parse trial design from json or yaml text
+
+	The format is given by the file suffix (.json, .yaml or .yml) or, if there is no known suffix, detected from the content: json documents start with "{" or "[". Text that is not valid json is parsed as yaml.
+	"""
+	suffix = suffix.lower()
+	if suffix not in (".yaml", ".yml") and (suffix == ".json" or text.lstrip()[:1] in ("{", "[")):
+		try:
+			return(json_parser()(text))
+		except ValueError as err:
+			try:
+				return(yaml_parser()(text))
+			except Exception:
+				raise ValueError(f'{err}')
+	return(yaml_parser()(text))
+
+
+def read_design(infile):
+	"""read trial design from json or yaml file, or from the standard input if infile is "-"
+
+	The input is read once and parsed with the parser for its format (see parse_design).
+	"""
+	try:
+		if str(infile) == STDIN:
+			(text, suffix) = (sys.stdin.read(), "")
+		else:
+			with open(infile) as f:
+				(text, suffix) = (f.read(), pathlib.Path(infile).suffix)
+	except FileNotFoundError:
+		raise FileNotFoundError(f'Input file {infile} does not exist')
+	try:
+		return(parse_design(text, suffix))
+	except Exception as err:
+		raise ValueError(f'Syntax error in input file {infile}:\n{err}')
+
+
+# RENDER CACHE
+
+def file_mode():
+	"""return the permissions of new files under the current umask, for files created with tempfile.mkstemp, which are only accessible to the owner"""
+	umask = os.umask(0)
+	os.umask(umask)
+	return(0o666 & ~umask)
+
+
+def cache_key(td, **kwargs):
+	"""return a content hash of a parsed trial design, the rendering options and the tool version
+
+	Options that are not given count with their default value (see render_td), so that the same render has the same key in the command line tool and in the render server. profile and stream do not change the output and are ignored.
+	"""
+	import inspect
+	options = {name: p.default for name, p in inspect.signature(render_td).parameters.items() if p.default is not inspect.Parameter.empty}
+	options.update(kwargs)
+	for name in ("profile", "stream"):
+		options.pop(name, None)
+	payload = json.dumps([__version__, td, options], sort_keys=True, default=str)
+	return(hashlib.sha256(payload.encode("utf-8")).hexdigest())
+
+
+def cache_lookup(cache_dir, key, output_format="svg"):
+	"""return the cached output file for key, or None if it is not cached"""
+	path = pathlib.Path(cache_dir).joinpath(f'{key}.{output_format}')
+	try:
+		os.utime(path)  # mark as recently used
+	except FileNotFoundError:
+		return(None)
+	return(path)
+
+
+def cache_store(cache_dir, key, svg_out, max_size=100 * 2**20, output_format="svg"):
+	"""store svg output (string, or bytes for other output formats) under key and evict old entries from the cache
+
+	The entries are named after the key, with the output format as suffix.
+	"""
+	import tempfile
+	cache_dir = pathlib.Path(cache_dir)
+	cache_dir.mkdir(parents=True, exist_ok=True)
+	# write to a temporary file first, so that concurrent readers never see partial entries
+	(fd, temp) = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+	with os.fdopen(fd, "wb" if isinstance(svg_out, bytes) else "w") as f:
+		f.write(svg_out)
+	os.chmod(temp, file_mode())
+	os.replace(temp, cache_dir.joinpath(f'{key}.{output_format}'))
+	evict_cache(cache_dir, max_size)
+
+
+def evict_cache(cache_dir, max_size):
+	"""delete the least recently used cache entries until the cache size is at most max_size bytes"""
+	entries = []
+	for f in pathlib.Path(cache_dir).glob("*.*"):
+		if f.suffix == ".tmp":
+			continue  # not yet stored
+		try:
+			stat = f.stat()
+		except FileNotFoundError:
+			continue
+		entries.append((stat.st_mtime, stat.st_size, f))
+	total = sum([size for (mtime, size, f) in entries])
+	for (mtime, size, f) in sorted(entries):
+		if total <= max_size:
+			break
+		try:
+			f.unlink()
+		except FileNotFoundError:
+			pass
+		total -= size
+
+
+VARIANT_FLAGS = {"c": "condensed", "t": "timescale", "g": "graph", "e": "ellipsis", "n": "footnotes", "a": "autocompress"}
+
+
+def parse_variant(name):
+	"""convert variant name to rendering options
+
+	The name combines the short command line flags c, t, g, e, n, a and A (equivalent to ctgen) with an optional font size, e.g., "c", "A" or "ct10". "plain" has no options.
+	"""
+	m = re.fullmatch(r'([ctgenaA]*)(\d*)', name)
+	if name == "plain":
+		return({})
+	if not name or not m:
+		raise ValueError(f'invalid variant "{name}"')
+	out = {}
+	for flag in m[1].replace("A", "ctgen"):
+		out[VARIANT_FLAGS[flag]] = True
+	if m[2]:
+		out["fontsize"] = int(m[2])
+	return(out)
+
+
+def variant_file(outfile, name):
+	"""return the output file for a variant, i.e., with the variant name appended to the file name"""
+	if not name:
+		return(outfile)
+	if str(outfile) == STDIN:
+		raise ValueError("variants cannot be written to the standard output")
+	return(outfile.with_name(f'{outfile.stem}-{name}{outfile.suffix}'))
+
+
+def write_output(outfile, svg_out):
+	"""write svg document (string, or bytes for other output formats) to file, "-" for the standard output"""
+	binary = isinstance(svg_out, bytes)
+	if str(outfile) == STDIN:
+		if binary:
+			sys.stdout.flush()
+			sys.stdout.buffer.write(svg_out)
+		else:
+			sys.stdout.write(svg_out)
+	else:
+		with open(outfile, "wb" if binary else "w") as f:
+			f.write(svg_out)
+
+
+def render_file(infile, outfile, debug=False, cache="", cache_size=100 * 2**20, variants=None, **kwargs):
+	"""render trial design file to svg file, "-" for the standard input or output. Keyword arguments are passed on to render_td
+
+	If cache names a cache directory, the output is copied from there if the design and the options are unchanged since an earlier render. variants is a dictionary of rendering options by variant name (see parse_variant) that add to the keyword arguments. The variants are written to separate files (see variant_file) and share the validation and preparation of the design.
+	"""
+	td = read_design(infile)
+	if debug:
+		print(json.dumps(td, indent=2))
+		print("---")
+		import yaml
+		print(yaml.dump(td, default_flow_style=None))
+
+	title = design_name(infile)
+	pending = {}
+	for name, options in (variants or {"": {}}).items():
+		target = variant_file(outfile, name)
+		key = None
+		output_format = {**kwargs, **options}.get("output_format", "svg")
+		if cache:
+			key = cache_key(td, title=title, debug=debug, **{**kwargs, **options})
+			cached = cache_lookup(cache, key, output_format)
+			if cached:
+				if str(target) == STDIN:
+					write_output(target, cached.read_bytes())
+				else:
+					import shutil
+					shutil.copyfile(cached, target)
+				continue
+		pending[name] = (target, key, options, output_format)
+
+	if pending:
+		svgs = render_variants(td, [options for (target, key, options, output_format) in pending.values()], title=title, debug=debug, **kwargs)
+		for (target, key, options, output_format), svg_out in zip(pending.values(), svgs):
+			write_output(target, svg_out)
+			if cache:
+				cache_store(cache, key, svg_out, cache_size, output_format)
+	return
+
+
+def init_worker(font="Arial", fontsize=14, engine="cairo", glyph_table=""):
+	"""set up the text metrics once per worker process"""
+	if not callable(engine):
+		font_metrics(font, fontsize, engine, glyph_table)
+
+
+def render_files(files, jobs=1, **kwargs):
+	"""render (infile, outfile) pairs, in a pool of worker processes if jobs is not 1
+
+	Yields (infile, error) for each file as soon as it is finished, error is None for successful renders. jobs=0 uses one process per CPU. Keyword arguments are passed on to render_file.
+	"""
+	if jobs == 1 or len(files) < 2:
+		for (infile, outfile) in files:
+			try:
+				render_file(infile, outfile, **kwargs)
+			except Exception as err:
+				yield((infile, err))
+			else:
+				yield((infile, None))
+		return
+
+	import concurrent.futures
+	initargs = (kwargs.get("font", "Arial"), kwargs.get("fontsize", 14), kwargs.get("text_metrics", "cairo"), kwargs.get("glyph_table", ""))
+	with concurrent.futures.ProcessPoolExecutor(max_workers=jobs or None, initializer=init_worker, initargs=initargs) as pool:
+		futures = {pool.submit(render_file, infile, outfile, **kwargs): infile for (infile, outfile) in files}
+		for future in concurrent.futures.as_completed(futures):
+			yield((futures[future], future.exception()))
+
+
+def watch_files(inputs, batch=False, output="", interval=0.5, jobs=1, suffix=".svg", **kwargs):
+	"""render design files and re-render them whenever they change, until interrupted
+
+	The inputs are polled for modifications; files that are added to watched directories or match watched glob patterns are picked up as well. A modified file is only re-rendered if its parsed content changed. The files that changed together are rendered with render_files, keyword arguments are passed on to render_file.
+	"""
+	mtimes = {}
+	keys = {}
+	while True:
+		changed = {}
+		for infile in expand_inputs(inputs):
+			try:
+				mtime = infile.stat().st_mtime_ns
+			except FileNotFoundError:
+				continue
+			if mtimes.get(infile) == mtime:
+				continue
+			mtimes[infile] = mtime
+			try:
+				key = cache_key(read_design(infile), **{k: v for k, v in kwargs.items() if k != "cache"})
+			except Exception as err:
+				typer.echo(f'{time.strftime("%H:%M:%S")} {infile}: {err}', err=True)
+				continue
+			if keys.get(infile) != key:
+				changed[infile] = key
+		tasks = []
+		if changed:
+			try:
+				tasks = [(infile, outfile) for (infile, outfile) in output_files(expand_inputs(inputs), output, batch, suffix) if infile in changed]
+			except ValueError as err:
+				typer.echo(f'{time.strftime("%H:%M:%S")} {err}', err=True)
+		for (infile, err) in render_files(tasks, jobs=jobs, **kwargs):
+			if err is None:
+				keys[infile] = changed[infile]
+				typer.echo(f'{time.strftime("%H:%M:%S")} rendered {infile}')
+			else:
+				typer.echo(f'{time.strftime("%H:%M:%S")} {infile}: {err}', err=True)
+		time.sleep(interval)
 
 
 ########################################
@@ -1191,8 +2424,8 @@ def license_callback(value: bool):
 
 @app.command()
 def main(
-	file: str = typer.Argument(...),
-	output: str = typer.Option("", "--output", "-o", help="Output file name"),
+	files: List[str] = typer.Argument(..., help="Input files, glob patterns or directories, '-' for standard input", metavar="FILES..."),
+	output: str = typer.Option("", "--output", "-o", help="Output file name, or output directory for multiple input files, '-' for standard output"),
 	font: str = typer.Option("Arial", "--font", "-f", help="Font type"),
 	fontsize: int = typer.Option(14, "--fontsize", "-s", help="Font size"),
 	padding: float = typer.Option(1, "--padding", "-p", help="Y-axis padding factor"),
@@ -1203,6 +2436,19 @@ def main(
 	footnotes: bool = typer.Option(False, "--footnotes", "-n", help="Show footnotes"),
 	all: bool = typer.Option(False, "--all", "-A", help="All options, equivalent to -ctgen"),
 	autocompress: bool = typer.Option(False, "--autocompress", "-a", help="Automatically compress daygrid"),
+	output_format: str = typer.Option("svg", "--format", "-F", help="Output format (svg, svgz, pdf or png), default: from the output file name or svg"),
+	compact: bool = typer.Option(False, "--compact", "-z", help="Compact svg output with shared symbols and styles"),
+	scale: float = typer.Option(1, "--scale", help="Pixels per point for png output"),
+	metrics: str = typer.Option("cairo", "--metrics", "-m", help="Text metrics engine (cairo or glyphs)"),
+	glyph_table: str = typer.Option("", "--glyph-table", help="Glyph metrics file for the glyphs engine, implies '-m glyphs'"),
+	cache: str = typer.Option("", "--cache", help="Render cache directory, re-use output for unchanged input and options"),
+	cache_size: int = typer.Option(100, "--cache-size", help="Maximum render cache size in MB"),
+	variants: str = typer.Option("", "--variants", "-V", help="Comma-separated variants to render in one pass, e.g. 'plain,c,a,A,A10', written to files named after the variants"),
+	watch: bool = typer.Option(False, "--watch", "-w", help="Re-render input files whenever they change, until interrupted"),
+	profile: bool = typer.Option(False, "--profile", help="Print the time spent per rendering phase"),
+	profile_json: str = typer.Option("", "--profile-json", help="Save the time spent per rendering phase to json file"),
+	profile_stats: str = typer.Option("", "--profile-stats", help="Save cProfile statistics to file (pstats format)"),
+	jobs: int = typer.Option(1, "--jobs", "-j", min=0, help="Number of parallel rendering processes for multiple files, 0 for one per CPU"),
 	debug: bool = typer.Option(False, "--debug", "-D", help="Debug output"),
 	version: bool = typer.Option(False, "--version", help="Show version and exit", callback=version_callback),
 	#license: bool = typer.Option(False, "--license", help="Show license and exit", callback=license_callback)
@@ -1210,7 +2456,7 @@ def main(
 	"""TD: Clinical trial design visualization
 
 
-	Generates a 'Schedule of Assessments' figure for clinical trials, based on a json-formatted input FILE. Graphical output is provided in svg vector format that can be rendered by any webbrowser or directly imported into Office applications. Use below OPTIONS to manage the output style.
+	Generates a 'Schedule of Assessments' figure for clinical trials, based on json- or yaml-formatted input FILES. Multiple files, glob patterns and directories are rendered in one run. Graphical output is provided in svg vector format that can be rendered by any webbrowser or directly imported into Office applications. Use below OPTIONS to manage the output style.
 
 	Full documentation is available at https://rstrotmann.github.io/td/.
 
@@ -1229,48 +2475,89 @@ def main(
 		ellipsis=True
 		footnotes=True
 
-	# read input file
-	infile = pathlib.Path(file)
-	inpath = pathlib.Path(file).resolve().parent
-	if output:
-		temp = pathlib.Path.cwd().joinpath(output)
-		if temp.is_dir():
-			outfile = temp.joinpath(infile.stem + ".svg")
-		else:
-			outfile = temp
-	else:
-		outfile = inpath.joinpath(infile.stem + ".svg")
-	try:
-		with open(infile) as f:
-			td = json.load(f)
-	except json.decoder.JSONDecodeError as err:
+	if glyph_table:
+		metrics = "glyphs"
+
+	suffix = pathlib.Path(output).suffix.lower()
+	if output_format == "svg" and suffix in (".svgz", ".pdf", ".png"):
+		output_format = suffix[1:]
+	if output_format not in ("svg", "svgz", "pdf", "png"):
+		sys.exit(f'unknown output format "{output_format}", use svg, svgz, pdf or png')
+
+	options = dict(fontsize=fontsize, font=font, condensed=condensed, autocompress=autocompress, timescale=timescale, padding=padding, ellipsis=ellipsis, footnotes=footnotes, graph=graph, text_metrics=metrics, glyph_table=glyph_table)
+	if compact:
+		options["compact"] = True
+	if output_format != "svg":
+		options.update(output_format=output_format, scale=scale)
+
+	if variants:
 		try:
-			with open(infile) as f:
-				td = yaml.safe_load(f)
-		except:
-				sys.exit(f'Syntax error in input file {infile}:\n{err}')
-	except FileExistsError:
-		sys.exit("Input file does not exist")
+			options["variants"] = {name: parse_variant(name) for name in variants.split(",")}
+		except ValueError as err:
+			sys.exit(f'{err}')
 
-	if debug:
-		print(json.dumps(td, indent=2))
-		print("---")
-		print(yaml.dump(td, default_flow_style=None))
+	infiles = expand_inputs(files)
+	if not infiles:
+		sys.exit("No input files found")
+	batch = is_batch(files) or len(infiles) > 1
 
-	# render
+	if watch:
+		try:
+			watch_files(files, batch=batch, output=output, jobs=jobs, suffix="." + output_format, debug=debug, cache=cache, cache_size=cache_size * 2**20, **options)
+		except KeyboardInterrupt:
+			pass
+		return
+
+	# the standard input can only be read in this process
+	if STDIN in [str(i) for i in infiles]:
+		jobs = 1
+
+	# profiling is only supported for renders in this process
+	phases = None
+	if profile or profile_json or profile_stats:
+		phases = {}
+		options["profile"] = phases
+		jobs = 1
+	if profile_stats:
+		import cProfile
+		profiler = cProfile.Profile()
+		profiler.enable()
+
+	# render, continue with the next file on errors
+	failures = []
 	try:
-		svg_out = render_td(td, title=infile.stem, debug=debug, fontsize=fontsize, font=font, condensed=condensed, autocompress=autocompress, timescale=timescale, padding=padding, ellipsis=ellipsis, footnotes=footnotes, graph=graph)
-	except Exception as err:
-		sys.exit(err)
-
-	# write to disk
-	with open(outfile, "w") as f:
-		f.write(svg_out)
+		tasks = output_files(infiles, output, batch, "." + output_format)
+	except ValueError as err:
+		sys.exit(f'{err}')
+	for (infile, err) in render_files(tasks, jobs=jobs, debug=debug, cache=cache, cache_size=cache_size * 2**20, **options):
+		if err is not None:
+			failures.append((infile, err))
+			if batch:
+				typer.echo(f'{infile}: {err}', err=True)
+
+	if profile_stats:
+		profiler.disable()
+		profiler.dump_stats(profile_stats)
+	if profile_json:
+		with open(profile_json, "w") as f:
+			json.dump(phases, f, indent=2)
+	if profile:
+		typer.echo(format_profile(phases), err=True)
+
+	if not batch:
+		if failures:
+			sys.exit(failures[0][1])
+		return
+	typer.echo(f'{len(infiles) - len(failures)} of {len(infiles)} files rendered')
+	if failures:
+		typer.echo("failed:", err=True)
+		for (infile, err) in failures:
+			typer.echo(f'  {infile}', err=True)
+		sys.exit(1)
 	return
 
 
 
-
 if __name__ == "__main__":
 	app()
 
@@ -1,8 +1,13 @@
 import sys
 import json
 import pathlib
+import subprocess
+import time
 from td.td import *
 
+# start-up time budget for `td --version` in seconds, best of three runs
+STARTUP_BUDGET = 0.5
+
 
 # def test_render_td():
 #     test_files = [i for i in pathlib.Path(r'./td/tests/fixtures').glob('*.json')]
@@ -30,3 +35,67 @@ def test_svg_output():
         print(infile)
         outfile = outpath.joinpath(infile.stem + ".svg")
         _make_svg(infile, outfile, condensed=True, ellipsis=True, footnotes=True, graph=True, timescale=True)
+
+
+def test_startup():
+    code = "import sys, td.td; print(' '.join(m for m in ('cairo', 'yaml') if m in sys.modules))"
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == ""
+    timings = []
+    for i in range(3):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-m", "td.td", "--version"], capture_output=True, check=True)
+        timings.append(time.perf_counter() - start)
+    assert min(timings) < STARTUP_BUDGET
+
+
+def test_render_api():
+    import copy
+    import io
+    import td
+    design = td.read_design(pathlib.Path(__file__).parent.joinpath("fixtures", "good_input.json"))
+    original = copy.deepcopy(design)
+    svg = td.render(design, condensed=True, timescale=True)
+    assert design == original
+    assert td.render(design, condensed=True, timescale=True) == svg
+    assert td.render(design, encoding="utf-8", condensed=True, timescale=True) == svg.encode("utf-8")
+    stream = io.BytesIO()
+    td.render(design, stream=stream, condensed=True, timescale=True)
+    assert stream.getvalue() == svg.encode("utf-8")
+
+
+def test_batch_output(tmp_path):
+    from typer.testing import CliRunner
+    good = pathlib.Path(__file__).parent.joinpath("fixtures", "good_input.json").read_text()
+    for name in ("a", "b"):
+        tmp_path.joinpath("in", name).mkdir(parents=True)
+        tmp_path.joinpath("in", name, "x.json").write_text(good)
+    tmp_path.joinpath("in", "b", "bad.json").write_text('{"periods": [{"caption": "P"}]}')
+    runner = CliRunner()
+
+    # a directory is rendered in batch mode, even with a single design
+    result = runner.invoke(app, [str(tmp_path.joinpath("in", "a")), "-o", str(tmp_path.joinpath("out1"))])
+    assert result.exit_code == 0
+    assert tmp_path.joinpath("out1", "x.svg").is_file()
+
+    # designs with the same name keep their relative path, failures are listed at the end
+    result = runner.invoke(app, [str(tmp_path.joinpath("in", "a", "x.json")), str(tmp_path.joinpath("in", "b")), "-o", str(tmp_path.joinpath("out2"))])
+    assert result.exit_code == 1
+    assert tmp_path.joinpath("out2", "a", "x.svg").is_file()
+    assert tmp_path.joinpath("out2", "b", "x.svg").is_file()
+    assert "2 of 3 files rendered" in result.stdout
+    assert "bad.json" in result.output
+
+    # designs that would overwrite each other are rejected
+    tmp_path.joinpath("in", "b", "x.yaml").write_text(good)
+    result = runner.invoke(app, [str(tmp_path.joinpath("in", "b")), "-o", str(tmp_path.joinpath("out3"))])
+    assert result.exit_code == 1
+    assert not tmp_path.joinpath("out3", "x.svg").exists()
+
+
+def test_cairo_output():
+    import pytest
+    pytest.importorskip("cairo")
+    design = read_design(pathlib.Path(__file__).parent.joinpath("fixtures", "good_input.json"))
+    assert render_td(design, output_format="pdf", condensed=True, timescale=True).startswith(b"%PDF")
+    assert render_td(design, output_format="png", scale=2, condensed=True, timescale=True).startswith(b"\x89PNG")
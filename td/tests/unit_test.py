@@ -10,3 +10,201 @@ def convert_bool(input):
 #     print(f'input:    {convert_bool(data)}')
 #     print(f'leading:  {convert_bool(leading_edge(data))}')
 #     print(f'trailing: {convert_bool(trailing_edge(data))}')
+
+
+def test_glyph_text_extents():
+    table = {"X": (1, -7, 8, 7, 10), " ": (0, 0, 0, 0, 5), "x": (1, -5, 6, 5, 8)}
+    extents = glyph_text_extents(table)
+    assert extents("X") == (8, 7)
+    assert extents("XxX") == (26, 7)
+    assert extents(" X ") == (8, 7)
+    assert extents("  ") == (0, 0)
+    assert extents("?") == extents("X")
+
+
+def test_decode_daylist():
+    assert decode_daylist([1, "3-5", "7, 9-10"]) == [1, 3, 4, 5, 7, 9, 10]
+    assert decode_daylist("1-3") == [1, 2, 3]
+    assert decode_daylist(2) == [2]
+    assert decode_daylist([1, None, "x"]) == [1]
+    first = decode_daylist(["1-365"])
+    first.append(0)
+    assert decode_daylist(["1-365"]) == list(range(1, 366))
+
+
+def test_period_tree():
+    td = {"periods": [
+        {"caption": "A", "periods": [{"caption": "A1"}, {"caption": "B", "periods": [{"caption": "B1"}, {"caption": "B2"}]}]},
+        {"caption": "C"}]}
+    (periods, groups) = period_tree(td)
+    assert [p["caption"] for p in periods] == ["A1", "B1", "B2", "C"]
+    assert groups == ((0, 2, "A"), (1, 2, "B"))
+    assert get_period_nesting(td) == get_period_nesting(td)
+    assert get_period_nesting({"cycles": []}) == ()
+
+
+def test_parse_design():
+    assert parse_design('{"periods": []}') == {"periods": []}
+    assert parse_design('periods:\n- caption: A\n  duration: 2\n') == {"periods": [{"caption": "A", "duration": 2}]}
+    assert parse_design('{periods: []}', ".json") == {"periods": []}
+    assert parse_design('{"periods": []}', ".yaml") == {"periods": []}
+
+
+def test_server_request():
+    import asyncio
+    from td.server import handle_request, request_options
+
+    assert request_options("condensed&fontsize=10") == {"condensed": True, "fontsize": 10}
+    assert request_options("all=1&graph=0")["graph"] is False
+
+    async def render(td, options):
+        return(f'<svg>{len(td["periods"])} {options}</svg>')
+
+    def request(method, target, body=b""):
+        return(asyncio.run(handle_request(method, target, body, render)))
+
+    assert request("GET", "/health")[0] == 200
+    assert request("POST", "/render?timescale", b'{"periods": []}') == (200, "image/svg+xml", "<svg>0 {'timescale': True}</svg>")
+    assert request("POST", "/render?bogus=1", b'{"periods": []}')[0] == 400
+    assert request("GET", "/render")[0] == 405
+    assert request("GET", "/other")[0] == 404
+
+
+def test_parse_variant():
+    assert parse_variant("plain") == {}
+    assert parse_variant("ct") == {"condensed": True, "timescale": True}
+    assert parse_variant("A10") == {"condensed": True, "timescale": True, "graph": True, "ellipsis": True, "footnotes": True, "fontsize": 10}
+    for name in ["", "x", "c-t"]:
+        try:
+            parse_variant(name)
+        except ValueError:
+            pass
+        else:
+            assert False, name
+
+
+def test_compact_svg_writer():
+    out = CompactSvgWriter(precision=2)
+    assert out.num(1.23456) == "1.23"
+    assert out.num(2.0) == "2"
+    assert out.num(-0.001) == "0"
+    out.symbol(10, 20, 5, "diamond", size=10, lwd=1)
+    out.symbol(30.004, 20, 5, "diamond", size=10, lwd=1)
+    out.rect(0, 0, 1, 1, lwd=1)
+    svg = out.document(100, 50)
+    assert svg.count("<path") == 1
+    assert svg.count("<use") == 2
+    assert 'x="30"' in svg
+    assert len(out.styles) == 1
+
+
+def test_period_shapes():
+    period = {"start": 1, "duration": 2, "procedures": [{"caption": "A", "days": [1]}]}
+    periods = [dict(period, caption="C1"), dict(period, caption="C2"), dict(period, caption="C3", duration=3)]
+    assert period_shapes(periods) == [0, 0, 1]
+    out = CompactSvgWriter()
+    position = out.position()
+    out.rect(0, 0, 1, 1)
+    fragment = out.since(position)
+    out.place(fragment, 10)
+    out.place(fragment, 20)
+    svg = out.document(50, 10)
+    assert svg.count("<rect") == 2
+    assert '<use xlink:href="#g0" x="20" y="0"/>' in svg
+
+
+def test_expand_repeat():
+    cycle = {"caption": "C{n}", "start": -1, "duration": 3, "repeat": {"count": 3, "offset": 3},
+        "procedures": [{"caption": "ECG", "days": [-1, "1-2"], "relative": 1, "footnotes": [{"days": 1, "symbol": "a", "text": "x"}]}]}
+    periods = list(expand_repeat(cycle))
+    assert [p["caption"] for p in periods] == ["C1", "C2", "C3"]
+    assert [p["start"] for p in periods] == [-1, 3, 6]
+    assert periods[2]["procedures"][0]["days"] == [6, 7, 8]
+    assert periods[1]["procedures"][0]["footnotes"][0]["days"] == [4]
+    assert "repeat" not in periods[0] and cycle["procedures"][0]["days"] == [-1, "1-2"]
+    repeated = list(expand_repeat(dict(cycle, caption="Cycle", repeat=2)))
+    assert [p["caption"] for p in repeated] == ["Cycle 1", "Cycle 2"]
+    assert repeated[0]["procedures"] is repeated[1]["procedures"]
+    template = {k: v for k, v in cycle.items() if k != "repeat"}
+    plain = [dict(template, caption="Cycle 1"), dict(template, caption="Cycle 2")]
+    assert prepare_design({"periods": [dict(cycle, caption="Cycle", repeat=2)]}).periods == prepare_design({"periods": plain}).periods
+    cycles = prepare_design({"cycles": [{"caption": "C{n}", "duration": 21, "repeat": {"count": 3, "offset": 21}, "procedures": [{"caption": "ECG", "days": [1, 8]}]}]}).periods
+    assert [p["start"] for p in cycles] == [1, 22, 43]
+    assert cycles[2]["procedures"][0]["days"] == [43, 50]
+
+
+def test_day_masks():
+    data = [False, False, True, True, True, False, True, False, False]
+    assert convert_bool(leading_edge(data)) == [0, 0, 1, 0, 0, 0, 1, 0, 0]
+    assert convert_bool(trailing_edge(data)) == [0, 0, 0, 0, 1, 0, 1, 0, 0]
+    assert mask_list(list_mask(data), len(data)) == data
+    assert extract_start_end([-2, -1, 1, 2, 5, 7, 8]) == [-2, 2, 5, 7, 8]
+    period = {"start": -1, "duration": 6, "procedures": [{"caption": "A", "days": ["2-3"]}], "dayshading": [-1, 5]}
+    assert day_mask(period, [-1, 1, 5]) == 0b100011
+    assert convert_bool(activity_days(period)) == [1, 0, 1, 1, 0, 1]
+    assert convert_bool(day_shadings(period)) == [1, 0, 0, 0, 0, 1]
+
+
+def test_highlight_below_shading():
+    td = {"periods": [{"caption": "P", "start": 1, "duration": 3, "dayshading": [2], "decoration": "highlighted"}]}
+    svg = render_td(td, text_metrics=lambda text: (len(text) * 8, 10))
+    assert "#eee" in svg and "lightgray" in svg
+    assert svg.index("#eee") < svg.index("lightgray")
+
+
+def test_compact_circle_line_width():
+    out = CompactSvgWriter()
+    out.symbol(10, 10, 4, "circle", fill=True, fill_color="black")
+    out.symbol(20, 10, 4, "circle", lwd=2)
+    assert "stroke-width:1.2" in out.document(30, 20)
+    assert "stroke-width:2" in out.document(30, 20)
+    assert "stroke-width:1.2" in svg_symbol(10, 10, 4, "circle", fill=True, fill_color="black")
+
+
+def test_svg_arc_center():
+    import math
+    # quarter circle from (0, 0) to (1, 1), in svg coordinates with the y axis pointing down
+    (cx, cy, r, a1, a2) = svg_arc_center(0, 0, 1, 1, 1, large_arc=0, sweep=1)
+    assert (round(cx, 9), round(cy, 9), r) == (0, 1, 1)
+    assert (round(a1, 9), round(a2, 9)) == (round(-math.pi/2, 9), 0)
+    (cx, cy, r, a1, a2) = svg_arc_center(0, 0, 1, 1, 1, large_arc=0, sweep=0)
+    assert (round(cx, 9), round(cy, 9), r) == (1, 0, 1)
+    assert (round(a1, 9), round(a2, 9)) == (round(math.pi, 9), round(math.pi/2, 9))
+    # the radius is scaled up to connect the end points
+    assert svg_arc_center(0, 0, 2, 0, 0.5)[:3] == (1, 0, 1)
+    # brackets curve towards the enclosed content
+    (m, arc) = open_bracket_segments(10, 10, 20, 4, radius=2)[:2]
+    assert svg_arc_center(*m[1:], *arc[4:], arc[1], arc[2], arc[3])[0] > arc[4]
+    (m, arc) = close_bracket_segments(10, 10, 20, 4, radius=2)[:2]
+    assert svg_arc_center(*m[1:], *arc[4:], arc[1], arc[2], arc[3])[0] < arc[4]
+
+
+def test_render_cache(tmp_path):
+    import os
+    td = {"periods": [{"caption": "P", "start": 1, "duration": 3}]}
+    key = cache_key(td, title="study", condensed=True)
+    assert key == cache_key(td, title="study", condensed=True, debug=False, font="Arial", profile={})
+    assert key != cache_key(td, title="study")
+    assert key != cache_key(dict(td, cycles=[]), title="study", condensed=True)
+
+    assert cache_lookup(tmp_path, key) is None
+    cache_store(tmp_path, key, "<svg/>")
+    cache_store(tmp_path, "other", b"%PDF", output_format="pdf")
+    assert cache_lookup(tmp_path, key).read_text() == "<svg/>"
+    assert cache_lookup(tmp_path, "other", "pdf").read_bytes() == b"%PDF"
+    assert cache_lookup(tmp_path, "other") is None
+
+    # the least recently used entries are evicted first
+    os.utime(tmp_path.joinpath(f'{key}.svg'), (0, 0))
+    evict_cache(tmp_path, 4)
+    assert sorted(f.name for f in tmp_path.iterdir()) == ["other.pdf"]
+    evict_cache(tmp_path, 0)
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_footnote_day_out_of_range():
+    import pytest
+    td = {"periods": [{"caption": "P", "start": 1, "duration": 3, "procedures": [
+        {"caption": "ECG", "days": [1], "footnotes": [{"days": 9, "symbol": "a", "text": "x"}]}]}]}
+    with pytest.raises(RuntimeError, match="error parsing procedures: day index 9 out of range"):
+        prepare_design(td)